@@ -5,25 +5,31 @@ Bundle builder for Policy B installed-package closure.
 Creates self-contained repository bundles with RPMs and repodata.
 """
 
-import hashlib
-import json
+import logging
 import os
 import shutil
 import subprocess
 import sys
 import tarfile
+import time
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime, timezone
+from itertools import repeat
 from pathlib import Path
 from typing import Any
 
 from .resolver import DependencyResolver
 from .downloader import RPMDownloader
+from .hashing import HashingWriter
+from ..manifest_tools.jsonio import dumps_json
 
 
 class BundleBuilder:
     """Build self-contained RPM bundles."""
 
     SCHEMA_VERSION = "1.0"
+    ARCHIVE_BUFSIZE = 4 * 1024 * 1024
 
     def __init__(
         self,
@@ -31,6 +37,7 @@ class BundleBuilder:
         manifest_dir: str | Path,
         output_dir: str | Path,
         work_dir: str | Path | None = None,
+        compression_level: int = 9,
     ):
         """Initialize the bundle builder.
 
@@ -39,21 +46,32 @@ class BundleBuilder:
             manifest_dir: Directory containing host manifests.
             output_dir: Directory for final bundle output.
             work_dir: Working directory for intermediate files.
+            compression_level: zstd compression level (1-19).
         """
         if os_major not in (8, 9):
             raise ValueError(f"OS major must be 8 or 9, got: {os_major}")
 
+        if not 1 <= compression_level <= 19:
+            raise ValueError(
+                f"Compression level must be between 1 and 19, got: {compression_level}"
+            )
+
         self.os_major = os_major
         self.manifest_dir = Path(manifest_dir)
         self.output_dir = Path(output_dir)
         self.work_dir = Path(work_dir) if work_dir else Path("/tmp/bundle-build")
+        self.compression_level = compression_level
 
         self.output_dir.mkdir(parents=True, exist_ok=True)
         self.work_dir.mkdir(parents=True, exist_ok=True)
 
         self.bundle_id = ""
-        self.build_log: list[str] = []
+        # Records are tagged with this builder so that each build's handlers
+        # only see its own messages, even for concurrent builds
+        self.logger = logging.LoggerAdapter(logging.getLogger(__name__), {"builder": self})
         self.metadata: dict[str, Any] = {}
+        self._log_handlers: list[logging.Handler] = []
+        self._log_file_handler: logging.FileHandler | None = None
 
     def build(self) -> Path:
         """Execute the full bundle build process.
@@ -64,8 +82,6 @@ class BundleBuilder:
         timestamp = datetime.now(timezone.utc)
         self.bundle_id = f"bundle-rhel{self.os_major}-{timestamp.strftime('%Y%m%dT%H%M%SZ')}"
 
-        self._log(f"Starting bundle build: {self.bundle_id}")
-
         # Setup work directories
         bundle_work_dir = self.work_dir / self.bundle_id
         rpms_dir = bundle_work_dir / "rpms"
@@ -75,6 +91,9 @@ class BundleBuilder:
         rpms_dir.mkdir(parents=True, exist_ok=True)
         manifests_copy_dir.mkdir(parents=True, exist_ok=True)
 
+        self._start_logging(bundle_work_dir / "build.log")
+        self._log(f"Starting bundle build: {self.bundle_id}")
+
         try:
             # Step 1: Load and merge manifests
             self._log("Step 1: Loading manifests")
@@ -88,8 +107,17 @@ class BundleBuilder:
                 raise RuntimeError(f"No RHEL {self.os_major} manifests found")
 
             # Copy manifests to bundle
-            for manifest_file in self.manifest_dir.glob("*.json"):
-                shutil.copy2(manifest_file, manifests_copy_dir)
+            with os.scandir(self.manifest_dir) as entries:
+                manifest_files = [
+                    Path(entry.path) for entry in entries
+                    if entry.name.endswith(".json") and entry.is_file()
+                ]
+            with ThreadPoolExecutor() as executor:
+                list(executor.map(
+                    self._copy_manifest,
+                    manifest_files,
+                    repeat(manifests_copy_dir),
+                ))
 
             # Step 2: Get merged package list
             self._log("Step 2: Merging installed packages")
@@ -112,7 +140,8 @@ class BundleBuilder:
 
             # Step 4: Download RPMs
             self._log("Step 4: Downloading RPMs")
-            downloader = RPMDownloader(rpms_dir)
+            # The work dir is fresh per build, so a checksum cache never hits
+            downloader = RPMDownloader(rpms_dir, cache_checksums=False)
 
             if resolved:
                 results = downloader.download_packages(resolved)
@@ -123,41 +152,47 @@ class BundleBuilder:
                 for failed in downloader.get_failed_downloads():
                     self._log(f"  Failed: {failed.package.name} - {failed.error}")
 
-            # Step 5: Generate repodata
-            self._log("Step 5: Generating repodata")
-            self._generate_repodata(rpms_dir)
-            self._log("  Repodata generated")
-
-            # Step 6: Generate checksums
-            self._log("Step 6: Generating checksums")
-            downloader.generate_checksums_file(bundle_work_dir / "SHA256SUMS")
-
-            # Step 7: Build metadata
-            self._log("Step 7: Building metadata")
-            self.metadata = self._build_metadata(
-                timestamp=timestamp,
-                merger=merger,
-                resolved=resolved,
-                downloader=downloader,
-            )
-            metadata_path = bundle_work_dir / "metadata.json"
-            with open(metadata_path, "w") as f:
-                json.dump(self.metadata, f, indent=2)
-            self._log("  Metadata written")
-
-            # Step 8: Write build log
+            # Steps 5-7 are independent: createrepo only reads rpms_dir, so run
+            # it in the background while checksums and metadata are built
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                # Step 5: Generate repodata
+                self._log("Step 5: Generating repodata")
+                repodata = executor.submit(self._generate_repodata, rpms_dir)
+
+                # Step 6: Generate checksums
+                self._log("Step 6: Generating checksums")
+                downloader.generate_checksums_file(bundle_work_dir / "SHA256SUMS")
+
+                # Step 7: Build metadata
+                self._log("Step 7: Building metadata")
+                self.metadata = self._build_metadata(
+                    timestamp=timestamp,
+                    merger=merger,
+                    resolved=resolved,
+                    downloader=downloader,
+                )
+                # Encode in one call and write once; json.dump would issue a
+                # write per token
+                metadata_path = bundle_work_dir / "metadata.json"
+                metadata_path.write_bytes(dumps_json(self.metadata, indent=True))
+                self._log("  Metadata written")
+
+                repodata.result()
+                self._log("  Repodata generated")
+
+            # Step 8: Close build log so it is complete before archiving
             self._log("Step 8: Finalizing")
-            log_path = bundle_work_dir / "build.log"
-            with open(log_path, "w") as f:
-                f.write("\n".join(self.build_log) + "\n")
+            self._stop_file_logging()
 
             # Step 9: Create archive
             self._log("Step 9: Creating archive")
-            archive_path = self._create_archive(bundle_work_dir)
+            archive_path, bundle_hash = self._create_archive(bundle_work_dir)
             self._log(f"  Bundle created: {archive_path}")
 
-            # Compute final bundle hash
-            bundle_hash = self._compute_file_hash(archive_path)
+            # Record final bundle hash and write the checksum file
+            self.metadata["checksums"]["bundle_hash"] = bundle_hash
+            checksum_path = self.output_dir / f"{self.bundle_id}.sha256"
+            checksum_path.write_text(f"{bundle_hash}  {archive_path.name}\n")
             self._log(f"  SHA256: {bundle_hash}")
 
             return archive_path
@@ -167,20 +202,86 @@ class BundleBuilder:
             raise
 
         finally:
+            self._stop_logging()
+
             # Cleanup work directory
             if bundle_work_dir.exists():
                 shutil.rmtree(bundle_work_dir, ignore_errors=True)
 
+    def _start_logging(self, log_path: Path) -> None:
+        """Send build log messages to stdout and the bundle's build.log.
+
+        Args:
+            log_path: Path of the build log file.
+        """
+        formatter = logging.Formatter(
+            "[%(asctime)s.%(msecs)03dZ] %(message)s", "%Y-%m-%dT%H:%M:%S"
+        )
+        formatter.converter = time.gmtime
+
+        logger = self.logger.logger
+        self._log_file_handler = logging.FileHandler(log_path)
+        self._log_handlers = [logging.StreamHandler(sys.stdout), self._log_file_handler]
+        for handler in self._log_handlers:
+            handler.setLevel(logging.INFO)
+            handler.setFormatter(formatter)
+            handler.addFilter(self._is_own_record)
+            logger.addHandler(handler)
+
+    def _is_own_record(self, record: logging.LogRecord) -> bool:
+        """Check whether a log record was emitted by this builder."""
+        return getattr(record, "builder", None) is self
+
+    def _stop_file_logging(self) -> None:
+        """Flush and detach the build.log handler, leaving stdout logging."""
+        if self._log_file_handler is not None:
+            self.logger.logger.removeHandler(self._log_file_handler)
+            self._log_handlers.remove(self._log_file_handler)
+            self._log_file_handler.close()
+            self._log_file_handler = None
+
+    def _stop_logging(self) -> None:
+        """Detach and close all of this build's log handlers."""
+        self._stop_file_logging()
+        for handler in self._log_handlers:
+            self.logger.logger.removeHandler(handler)
+            handler.close()
+        self._log_handlers = []
+
     def _log(self, message: str) -> None:
         """Add message to build log.
 
         Args:
             message: Log message.
         """
-        timestamp = datetime.now(timezone.utc).isoformat()
-        log_entry = f"[{timestamp}] {message}"
-        self.build_log.append(log_entry)
-        print(log_entry)
+        logger = self.logger.logger
+        if logger.isEnabledFor(logging.INFO):
+            self.logger.info(message)
+            return
+
+        # The application's logger level must not drop records from build.log
+        record = logger.makeRecord(
+            logger.name, logging.INFO, "(unknown file)", 0, message, None, None,
+            extra={"builder": self},
+        )
+        for handler in self._log_handlers:
+            handler.handle(record)
+
+    def _copy_manifest(self, manifest_file: Path, dest_dir: Path) -> None:
+        """Place a manifest in the bundle, hard-linking when possible.
+
+        A hard link costs no data copy; fall back to a real copy when the
+        work directory is on a different filesystem.
+
+        Args:
+            manifest_file: Manifest to include.
+            dest_dir: Bundle manifests directory.
+        """
+        dest = dest_dir / manifest_file.name
+        try:
+            os.link(manifest_file, dest)
+        except OSError:
+            shutil.copy2(manifest_file, dest)
 
     def _generate_repodata(self, rpms_dir: Path) -> None:
         """Generate repository metadata using createrepo_c.
@@ -188,18 +289,31 @@ class BundleBuilder:
         Args:
             rpms_dir: Directory containing RPMs.
         """
+        options = [
+            "--workers", str(os.cpu_count() or 1),
+            "--checksum", "sha256",
+            str(rpms_dir),
+        ]
+
+        # --update only saves work when there is existing repodata to reuse
+        if (rpms_dir / "repodata").is_dir():
+            options.insert(0, "--update")
+
+        # Progress output is discarded; only stderr is kept for errors
         try:
             subprocess.run(
-                ["createrepo_c", "--update", str(rpms_dir)],
+                ["createrepo_c"] + options,
                 check=True,
-                capture_output=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
             )
         except FileNotFoundError:
             # Fall back to createrepo if createrepo_c not available
             subprocess.run(
-                ["createrepo", "--update", str(rpms_dir)],
+                ["createrepo"] + options,
                 check=True,
-                capture_output=True,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
             )
 
     def _build_metadata(
@@ -226,9 +340,7 @@ class BundleBuilder:
         package_hosts = merger.get_package_to_hosts_map()
 
         # Count package types
-        update_count = len([p for p in resolved if p.package_type == "update"])
-        security_count = len([p for p in resolved if p.package_type == "security"])
-        dependency_count = len([p for p in resolved if p.package_type == "dependency"])
+        type_counts = Counter(p.package_type for p in resolved)
 
         # Build package list with host mapping
         package_list = []
@@ -240,19 +352,19 @@ class BundleBuilder:
                 "nevra": pkg.nevra,
                 "type": pkg.package_type,
                 "sha256": result.sha256,
-                "size_bytes": result.local_path.stat().st_size if result.local_path else 0,
+                "size_bytes": result.size or 0,
                 "required_by": hosts_needing,
                 "advisory_id": pkg.advisory_id,
             })
 
-        # Build host package map
-        host_package_map = {}
-        for host_info in host_summary:
-            host_id = host_info["host_id"]
-            host_package_map[host_id] = [
-                pkg["nevra"] for pkg in package_list
-                if host_id in pkg.get("required_by", [])
-            ]
+        # Build host package map by inverting each package's required_by list
+        host_package_map: dict[str, list[str]] = {
+            host_info["host_id"]: [] for host_info in host_summary
+        }
+        for pkg in package_list:
+            # A host lists a name once per installed arch; map it only once
+            for host_id in dict.fromkeys(pkg["required_by"]):
+                host_package_map.setdefault(host_id, []).append(pkg["nevra"])
 
         return {
             "schema_version": self.SCHEMA_VERSION,
@@ -270,9 +382,9 @@ class BundleBuilder:
             ],
             "packages": {
                 "total_count": len(package_list),
-                "update_count": update_count,
-                "security_count": security_count,
-                "dependency_count": dependency_count,
+                "update_count": type_counts["update"],
+                "security_count": type_counts["security"],
+                "dependency_count": type_counts["dependency"],
                 "size_bytes": downloader.get_total_size(),
             },
             "package_list": package_list,
@@ -284,59 +396,130 @@ class BundleBuilder:
             "build_log": "build.log",
         }
 
-    def _create_archive(self, source_dir: Path) -> Path:
+    def _create_archive(self, source_dir: Path) -> tuple[Path, str]:
         """Create compressed archive from source directory.
 
+        The archive is hashed as it is written, so it is never read back.
+
         Args:
             source_dir: Directory to archive.
 
         Returns:
-            Path to created archive.
+            Tuple of (path to created archive, hex-encoded SHA256 hash).
         """
         archive_name = f"{self.bundle_id}.tar.zst"
         archive_path = self.output_dir / archive_name
 
-        # Try zstd compression first
+        # Try zstd compression first, streaming the tar straight into it
+        drain_error: BaseException | None = None
         try:
-            tar_path = self.output_dir / f"{self.bundle_id}.tar"
-
-            # Create tar archive
-            with tarfile.open(tar_path, "w") as tar:
-                tar.add(source_dir, arcname=self.bundle_id)
-
-            # Compress with zstd
-            subprocess.run(
-                ["zstd", "-19", "--rm", str(tar_path), "-o", str(archive_path)],
-                check=True,
-                capture_output=True,
-            )
+            with open(archive_path, "wb") as archive, subprocess.Popen(
+                [
+                    "zstd",
+                    f"-{self.compression_level}",
+                    "-T0",
+                    "--long=27",
+                    "-q",
+                    "-c",
+                ],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+            ) as proc:
+                writer = HashingWriter(archive)
+
+                def stop_zstd_on_failure(done: Future) -> None:
+                    # zstd would block on its full stdout pipe, and tar on
+                    # zstd's stdin; killing zstd makes tar fail with EPIPE
+                    if done.exception() is not None:
+                        proc.kill()
+
+                # Drain compressed output on a thread so the tar writer never blocks
+                with ThreadPoolExecutor(max_workers=1) as executor:
+                    drain = executor.submit(
+                        shutil.copyfileobj, proc.stdout, writer, self.ARCHIVE_BUFSIZE
+                    )
+                    drain.add_done_callback(stop_zstd_on_failure)
+                    try:
+                        self._write_tar_stream(source_dir, proc.stdin)
+                    finally:
+                        proc.stdin.close()
+                        drain_error = drain.exception()
+
+                if drain_error is not None:
+                    raise drain_error
+
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+            return archive_path, writer.hexdigest()
+
+        except (FileNotFoundError, BrokenPipeError, subprocess.CalledProcessError):
+            archive_path.unlink(missing_ok=True)
+
+            # A failed archive write (e.g. ENOSPC) is not a zstd problem and
+            # would fail the same way with gzip
+            if drain_error is not None:
+                raise drain_error
+
+        except BaseException:
+            archive_path.unlink(missing_ok=True)
+            raise
 
-            return archive_path
+        # Fall back to gzip
+        archive_name = f"{self.bundle_id}.tar.gz"
+        archive_path = self.output_dir / archive_name
 
-        except (FileNotFoundError, subprocess.CalledProcessError):
-            # Fall back to gzip
-            archive_name = f"{self.bundle_id}.tar.gz"
-            archive_path = self.output_dir / archive_name
+        try:
+            with open(archive_path, "wb") as archive:
+                writer = HashingWriter(archive)
+                with tarfile.open(
+                    str(archive_path),
+                    "w|gz",
+                    fileobj=writer,
+                    bufsize=self.ARCHIVE_BUFSIZE,
+                    copybufsize=self.ARCHIVE_BUFSIZE,
+                ) as tar:
+                    tar.add(source_dir, arcname=self.bundle_id)
+
+        except BaseException:
+            archive_path.unlink(missing_ok=True)
+            raise
 
-            with tarfile.open(archive_path, "w:gz") as tar:
-                tar.add(source_dir, arcname=self.bundle_id)
+        return archive_path, writer.hexdigest()
 
-            return archive_path
+    def _write_tar_stream(self, source_dir: Path, stream: Any) -> None:
+        """Write an uncompressed tar of source_dir to a stream.
 
-    def _compute_file_hash(self, filepath: Path) -> str:
-        """Compute SHA256 hash of a file.
+        Uses the system tar (bsdtar preferred) when available, which streams
+        far faster than the pure-Python tarfile module.
 
         Args:
-            filepath: Path to file.
-
-        Returns:
-            Hex-encoded SHA256 hash.
+            source_dir: Directory to archive.
+            stream: Writable binary stream backed by a file descriptor.
         """
-        sha256 = hashlib.sha256()
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                sha256.update(chunk)
-        return sha256.hexdigest()
+        tar_cmd = shutil.which("bsdtar") or shutil.which("tar")
+
+        if tar_cmd:
+            subprocess.run(
+                [
+                    tar_cmd,
+                    "--format=pax",
+                    "-cf", "-",
+                    "-C", str(source_dir.parent),
+                    source_dir.name,
+                ],
+                stdout=stream,
+                check=True,
+            )
+            return
+
+        with tarfile.open(
+            fileobj=stream,
+            mode="w|",
+            bufsize=self.ARCHIVE_BUFSIZE,
+            copybufsize=self.ARCHIVE_BUFSIZE,
+        ) as tar:
+            tar.add(source_dir, arcname=self.bundle_id)
 
 
 def main():
@@ -367,6 +550,14 @@ def main():
         "--work-dir",
         help="Working directory for intermediate files",
     )
+    parser.add_argument(
+        "--compression-level",
+        type=int,
+        default=9,
+        choices=range(1, 20),
+        metavar="{1-19}",
+        help="zstd compression level (default: 9)",
+    )
 
     args = parser.parse_args()
 
@@ -377,6 +568,7 @@ def main():
         manifest_dir=args.manifests,
         output_dir=args.output,
         work_dir=args.work_dir,
+        compression_level=args.compression_level,
     )
 
     try:
@@ -5,19 +5,25 @@ RPM downloader for Policy B installed-package closure.
 Downloads resolved RPMs from Red Hat CDN.
 """
 
-import hashlib
+import json
 import os
+import re
 import shutil
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
 from pathlib import Path
 from typing import Any
 
+from .hashing import sha256_file
 from .resolver import ResolvedPackage
 
+# RPM filenames follow <name>-<version>-<release>.<arch>.rpm
+_RPM_FILENAME_RE = re.compile(r"^(?P<name>.+)-[^-]+-[^-]+\.(?P<arch>[^.]+)\.rpm$")
 
-@dataclass
+
+@dataclass(slots=True)
 class DownloadResult:
     """Result of a package download."""
     package: ResolvedPackage
@@ -25,19 +31,44 @@ class DownloadResult:
     local_path: Path | None
     sha256: str | None
     error: str | None
+    size: int | None = None
 
 
 class RPMDownloader:
     """Download RPMs using DNF."""
 
-    def __init__(self, download_dir: str | Path):
+    # librepo tuning for bulk downloads of many small RPMs
+    DNF_DOWNLOAD_OPTIONS = [
+        "--setopt=max_parallel_downloads=10",
+        "--setopt=fastestmirror=True",
+    ]
+
+    # aria2c tuning: concurrent files, connections and segments per file
+    ARIA2C_OPTIONS = ["-j16", "-x4", "-s4"]
+
+    # Sidecar file mapping RPM filename to [size, mtime_ns, sha256]
+    CHECKSUM_CACHE_NAME = ".sha256cache.json"
+
+    def __init__(
+        self,
+        download_dir: str | Path,
+        use_aria2c: bool = False,
+        cache_checksums: bool = True,
+    ):
         """Initialize the downloader.
 
         Args:
             download_dir: Directory to store downloaded RPMs.
+            use_aria2c: Fetch RPMs with aria2c when it is installed. Only
+                useful for repositories that don't require client
+                certificates, such as internal mirrors.
+            cache_checksums: Reuse checksums from previous runs for RPMs
+                whose size and mtime are unchanged.
         """
         self.download_dir = Path(download_dir)
         self.download_dir.mkdir(parents=True, exist_ok=True)
+        self.use_aria2c = use_aria2c
+        self.cache_checksums = cache_checksums
         self.results: list[DownloadResult] = []
 
     def download_packages(
@@ -65,6 +96,24 @@ class RPMDownloader:
 
         print(f"Downloading {len(package_names)} packages to {self.download_dir}")
 
+        downloaded = False
+        if self.use_aria2c and shutil.which("aria2c"):
+            downloaded = self._download_with_aria2c(package_names, skip_existing)
+
+        if not downloaded:
+            self._download_with_dnf(package_names)
+
+        # Verify what was downloaded
+        self._verify_downloads(packages)
+
+        return self.results
+
+    def _download_with_dnf(self, package_names: list[str]) -> None:
+        """Download packages using dnf download.
+
+        Args:
+            package_names: Names of packages to download.
+        """
         try:
             # Use dnf download with resolve to get packages + deps
             result = subprocess.run(
@@ -74,8 +123,9 @@ class RPMDownloader:
                     "--alldeps",
                     f"--destdir={self.download_dir}",
                     "-y",
-                ] + package_names,
-                capture_output=True,
+                ] + self.DNF_DOWNLOAD_OPTIONS + package_names,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
                 text=True,
             )
 
@@ -86,10 +136,65 @@ class RPMDownloader:
         except subprocess.CalledProcessError as e:
             print(f"Error during download: {e}", file=sys.stderr)
 
-        # Verify what was downloaded
-        self._verify_downloads(packages)
+    def _download_with_aria2c(self, package_names: list[str], skip_existing: bool) -> bool:
+        """Download packages concurrently using aria2c.
 
-        return self.results
+        Package URLs come from dnf repoquery, so the package list must
+        already include the dependency closure.
+
+        Args:
+            package_names: Names of packages to download.
+            skip_existing: Skip RPMs that already exist locally.
+
+        Returns:
+            True if aria2c fetched every URL, False to fall back to dnf.
+        """
+        result = subprocess.run(
+            [
+                "dnf", "repoquery",
+                "--location",
+                "--latest-limit=1",
+                f"--arch={os.uname().machine},noarch",
+            ] + package_names,
+            capture_output=True,
+            text=True,
+        )
+
+        if result.returncode != 0:
+            print(f"Warning: dnf repoquery --location returned {result.returncode}")
+            return False
+
+        urls = [url for url in result.stdout.split() if url.endswith(".rpm")]
+        if skip_existing:
+            urls = [
+                url for url in urls
+                if not (self.download_dir / url.rsplit("/", 1)[-1]).exists()
+            ]
+
+        if not urls:
+            return True
+
+        aria_result = subprocess.run(
+            [
+                "aria2c",
+                *self.ARIA2C_OPTIONS,
+                f"--dir={self.download_dir}",
+                "--auto-file-renaming=false",
+                "--allow-overwrite=false",
+                "--console-log-level=warn",
+                "--input-file=-",
+            ],
+            input="\n".join(urls) + "\n",
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            text=True,
+        )
+
+        if aria_result.returncode != 0:
+            print(f"Warning: aria2c returned {aria_result.returncode}, falling back to dnf")
+            return False
+
+        return True
 
     def _verify_downloads(self, packages: list[ResolvedPackage]) -> None:
         """Verify downloaded packages and compute checksums.
@@ -97,55 +202,107 @@ class RPMDownloader:
         Args:
             packages: List of expected packages.
         """
-        # Get list of downloaded RPMs
-        downloaded_rpms = list(self.download_dir.glob("*.rpm"))
+        # Index downloaded RPMs in a single directory scan
+        rpm_by_name_arch: dict[tuple[str, str], Path] = {}
         rpm_by_name: dict[str, Path] = {}
+        rpm_stats: dict[Path, os.stat_result] = {}
+
+        with os.scandir(self.download_dir) as entries:
+            for entry in entries:
+                match = _RPM_FILENAME_RE.match(entry.name)
+                if not match or not entry.is_file():
+                    continue
 
-        for rpm_path in downloaded_rpms:
-            # Extract package name from filename
-            basename = rpm_path.stem
-            # Parse name from NEVRA pattern
-            parts = basename.rsplit("-", 2)
-            if len(parts) >= 3:
-                pkg_name = parts[0]
-                rpm_by_name[pkg_name] = rpm_path
+                rpm_path = Path(entry.path)
+                rpm_stats[rpm_path] = entry.stat()
+                rpm_by_name_arch[match["name"], match["arch"]] = rpm_path
+                rpm_by_name.setdefault(match["name"], rpm_path)
 
+        # Match each expected package to a downloaded RPM, preferring its arch
+        matches: list[tuple[ResolvedPackage, Path | None]] = []
         for pkg in packages:
-            rpm_path = rpm_by_name.get(pkg.name)
+            rpm_path = rpm_by_name_arch.get((pkg.name, pkg.arch)) or rpm_by_name.get(pkg.name)
+            matches.append((pkg, rpm_path))
+
+        # Reuse cached checksums for RPMs unchanged since the last run
+        cache = self._load_checksum_cache()
+        checksums: dict[Path, str] = {}
+        rpm_paths = []
+        for rpm_path in {path for _, path in matches if path is not None}:
+            stat = rpm_stats[rpm_path]
+            cached = cache.get(rpm_path.name)
+            if cached and cached[:2] == [stat.st_size, stat.st_mtime_ns]:
+                checksums[rpm_path] = cached[2]
+            else:
+                rpm_paths.append(rpm_path)
+
+        # Hash remaining RPMs in parallel (hashlib releases the GIL)
+        if rpm_paths:
+            with ThreadPoolExecutor(max_workers=os.cpu_count() or 1) as executor:
+                checksums.update(zip(rpm_paths, executor.map(sha256_file, rpm_paths)))
+
+        # Merge into the loaded cache so RPMs not matched this run keep their entries
+        if self.cache_checksums and rpm_paths:
+            cache.update(
+                (path.name, [rpm_stats[path].st_size, rpm_stats[path].st_mtime_ns, sha256])
+                for path, sha256 in checksums.items()
+            )
+            self._save_checksum_cache(cache)
 
-            if rpm_path and rpm_path.exists():
-                sha256 = self._compute_sha256(rpm_path)
+        for pkg, rpm_path in matches:
+            if rpm_path is not None:
                 self.results.append(DownloadResult(
                     package=pkg,
                     success=True,
                     local_path=rpm_path,
-                    sha256=sha256,
+                    sha256=checksums[rpm_path],
                     error=None,
+                    size=rpm_stats[rpm_path].st_size,
                 ))
             else:
-                # Try to find by partial match
-                found = False
-                for rpm_file in downloaded_rpms:
-                    if rpm_file.name.startswith(f"{pkg.name}-"):
-                        sha256 = self._compute_sha256(rpm_file)
-                        self.results.append(DownloadResult(
-                            package=pkg,
-                            success=True,
-                            local_path=rpm_file,
-                            sha256=sha256,
-                            error=None,
-                        ))
-                        found = True
-                        break
-
-                if not found:
-                    self.results.append(DownloadResult(
-                        package=pkg,
-                        success=False,
-                        local_path=None,
-                        sha256=None,
-                        error="Package not found in downloads",
-                    ))
+                self.results.append(DownloadResult(
+                    package=pkg,
+                    success=False,
+                    local_path=None,
+                    sha256=None,
+                    error="Package not found in downloads",
+                ))
+
+    def _load_checksum_cache(self) -> dict[str, list[Any]]:
+        """Load checksums cached by a previous run.
+
+        Returns:
+            Dictionary mapping RPM filename to [size, mtime_ns, sha256].
+            Malformed entries, or a malformed file, are treated as misses.
+        """
+        if not self.cache_checksums:
+            return {}
+
+        try:
+            with open(self.download_dir / self.CHECKSUM_CACHE_NAME) as f:
+                cache = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return {}
+
+        if not isinstance(cache, dict):
+            return {}
+        return {
+            name: entry
+            for name, entry in cache.items()
+            if isinstance(entry, list) and len(entry) == 3
+        }
+
+    def _save_checksum_cache(self, cache: dict[str, list[Any]]) -> None:
+        """Write the checksum cache for the next run.
+
+        Args:
+            cache: Dictionary mapping RPM filename to [size, mtime_ns, sha256].
+        """
+        try:
+            with open(self.download_dir / self.CHECKSUM_CACHE_NAME, "w") as f:
+                json.dump(cache, f)
+        except OSError as e:
+            print(f"Warning: could not write checksum cache: {e}", file=sys.stderr)
 
     def _compute_sha256(self, filepath: Path) -> str:
         """Compute SHA256 hash of a file.
@@ -156,11 +313,7 @@ class RPMDownloader:
         Returns:
             Hex-encoded SHA256 hash.
         """
-        sha256 = hashlib.sha256()
-        with open(filepath, "rb") as f:
-            for chunk in iter(lambda: f.read(8192), b""):
-                sha256.update(chunk)
-        return sha256.hexdigest()
+        return sha256_file(filepath)
 
     def get_successful_downloads(self) -> list[DownloadResult]:
         """Get list of successful downloads.
@@ -187,7 +340,9 @@ class RPMDownloader:
         total = 0
         for result in self.results:
             if result.success and result.local_path:
-                total += result.local_path.stat().st_size
+                if result.size is None:
+                    result.size = result.local_path.stat().st_size
+                total += result.size
         return total
 
     def generate_checksums_file(self, output_path: str | Path | None = None) -> Path:
@@ -218,12 +373,14 @@ class RPMDownloader:
 def download_all_updates(
     package_list: list[str],
     output_dir: str | Path,
+    use_aria2c: bool = False,
 ) -> tuple[list[DownloadResult], list[str]]:
     """Convenience function to download all updates for packages.
 
     Args:
         package_list: List of installed package names.
         output_dir: Directory for downloads.
+        use_aria2c: Fetch RPMs with aria2c when it is installed.
 
     Returns:
         Tuple of (download results, error messages).
@@ -238,7 +395,7 @@ def download_all_updates(
         return [], ["No packages to download"]
 
     # Download packages
-    downloader = RPMDownloader(output_dir)
+    downloader = RPMDownloader(output_dir, use_aria2c=use_aria2c)
     results = downloader.download_packages(resolved)
 
     return results, resolver.errors
@@ -271,6 +428,11 @@ def main():
         action="store_true",
         help="Generate SHA256SUMS file",
     )
+    parser.add_argument(
+        "--aria2c",
+        action="store_true",
+        help="Download with aria2c when installed (mirrors without client certs)",
+    )
 
     args = parser.parse_args()
 
@@ -288,7 +450,7 @@ def main():
         print("No packages specified.", file=sys.stderr)
         sys.exit(1)
 
-    results, errors = download_all_updates(packages, args.dest)
+    results, errors = download_all_updates(packages, args.dest, use_aria2c=args.aria2c)
 
     success_count = len([r for r in results if r.success])
     fail_count = len([r for r in results if not r.success])
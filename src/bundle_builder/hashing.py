@@ -0,0 +1,65 @@
+"""
+File hashing helpers for bundle building.
+
+Shared by the downloader (per-RPM checksums) and the builder (bundle hash).
+"""
+
+import hashlib
+import mmap
+import os
+from pathlib import Path
+from typing import BinaryIO
+
+
+def sha256_file(filepath: str | Path) -> str:
+    """Compute SHA256 hash of a file.
+
+    Args:
+        filepath: Path to file.
+
+    Returns:
+        Hex-encoded SHA256 hash.
+    """
+    with open(filepath, "rb") as f:
+        if hasattr(hashlib, "file_digest"):
+            return hashlib.file_digest(f, "sha256").hexdigest()
+
+        # Python < 3.11: hash a read-only mapping in a single update call
+        sha256 = hashlib.sha256()
+        if os.fstat(f.fileno()).st_size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                sha256.update(mm)
+        return sha256.hexdigest()
+
+
+class HashingWriter:
+    """Binary writer that computes SHA256 of everything passed through it."""
+
+    def __init__(self, fileobj: BinaryIO):
+        """Initialize the writer.
+
+        Args:
+            fileobj: Underlying binary file to write to.
+        """
+        self.fileobj = fileobj
+        self.sha256 = hashlib.sha256()
+
+    def write(self, data: bytes) -> int:
+        """Hash and write a chunk of data.
+
+        Args:
+            data: Bytes to write.
+
+        Returns:
+            Number of bytes written.
+        """
+        self.sha256.update(data)
+        return self.fileobj.write(data)
+
+    def hexdigest(self) -> str:
+        """Get the hash of all data written so far.
+
+        Returns:
+            Hex-encoded SHA256 hash.
+        """
+        return self.sha256.hexdigest()
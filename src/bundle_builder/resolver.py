@@ -5,15 +5,22 @@ Dependency resolver for Policy B installed-package closure.
 Uses DNF APIs to compute the full update set with dependency closure.
 """
 
+import contextlib
+import hashlib
 import json
+import os
 import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Any
 
+from ..manifest_tools.jsonio import dumps_json
 
-@dataclass
+
+@dataclass(slots=True)
 class ResolvedPackage:
     """A resolved package for download."""
     name: str
@@ -48,17 +55,27 @@ class ResolvedPackage:
 class DependencyResolver:
     """Resolve package updates and dependencies using DNF."""
 
-    def __init__(self, installed_packages: list[str], prefer_security: bool = True):
+    CACHE_TTL_SECONDS = 3600
+
+    def __init__(
+        self,
+        installed_packages: list[str],
+        prefer_security: bool = True,
+        cache_dir: str | Path | None = None,
+    ):
         """Initialize the resolver.
 
         Args:
             installed_packages: List of installed package names.
             prefer_security: Prefer security updates when available.
+            cache_dir: Directory for cached resolution results, or None to disable.
         """
         self.installed_packages = set(installed_packages)
         self.prefer_security = prefer_security
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
         self.resolved: list[ResolvedPackage] = []
         self.errors: list[str] = []
+        self._dep_cache: dict[frozenset[str], set[str]] = {}
 
     def resolve(self) -> list[ResolvedPackage]:
         """Resolve all updates and dependencies.
@@ -69,6 +86,14 @@ class DependencyResolver:
         self.resolved = []
         self.errors = []
 
+        cache_path = self._get_cache_path()
+        if cache_path is not None:
+            cached = self._load_cached_resolution(cache_path)
+            if cached is not None:
+                print(f"Using cached resolution: {cache_path}")
+                self.resolved = cached
+                return self.resolved
+
         # Step 1: Get available updates for installed packages
         updates = self._get_available_updates()
         if not updates:
@@ -77,28 +102,88 @@ class DependencyResolver:
 
         print(f"Found {len(updates)} packages with available updates.")
 
-        # Step 2: Get security updates specifically
-        security_updates = set()
-        if self.prefer_security:
-            security_updates = self._get_security_updates()
-            print(f"Found {len(security_updates)} security updates.")
-
-        # Step 3: Resolve full dependency closure
-        all_packages = self._resolve_dependencies(updates)
-
-        # Step 4: Classify packages
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            # Step 2: Get security updates specifically, in the background
+            # while step 3 runs; the dnf queries are independent. It starts
+            # only once updates are known so the no-updates path never waits.
+            security_future = None
+            if self.prefer_security:
+                security_future = executor.submit(self._get_security_updates)
+
+            # Step 3: Resolve full dependency closure
+            all_packages = self._resolve_dependencies(updates)
+
+            security_updates = set()
+            if security_future is not None:
+                security_updates = security_future.result()
+                print(f"Found {len(security_updates)} security updates.")
+
+        # Step 4: Classify packages; security takes precedence over update
+        package_types = dict.fromkeys(updates, "update")
+        package_types.update(dict.fromkeys(security_updates, "security"))
         for pkg in all_packages:
-            if pkg.name in security_updates:
-                pkg.package_type = "security"
-            elif pkg.name in updates:
-                pkg.package_type = "update"
-            else:
-                pkg.package_type = "dependency"
+            pkg.package_type = package_types.get(pkg.name, "dependency")
+
+        self.resolved.extend(all_packages)
 
-            self.resolved.append(pkg)
+        if cache_path is not None and not self.errors:
+            self._save_cached_resolution(cache_path)
 
         return self.resolved
 
+    def _get_cache_path(self) -> Path | None:
+        """Get the cache file for the current installed package set.
+
+        Returns:
+            Path to the cache file, or None if caching is disabled.
+        """
+        if self.cache_dir is None:
+            return None
+
+        key_source = "\n".join(sorted(self.installed_packages))
+        key_source += f"\nprefer_security={self.prefer_security}"
+        key = hashlib.sha256(key_source.encode()).hexdigest()
+        return self.cache_dir / f"{key}.json"
+
+    def _load_cached_resolution(self, cache_path: Path) -> list[ResolvedPackage] | None:
+        """Load a previous resolution if it is still fresh.
+
+        Args:
+            cache_path: Path to the cache file.
+
+        Returns:
+            List of resolved packages, or None on a cache miss.
+        """
+        try:
+            if time.time() - cache_path.stat().st_mtime > self.CACHE_TTL_SECONDS:
+                return None
+            entries = json.loads(cache_path.read_bytes())
+            return [
+                ResolvedPackage(package_type=entry.pop("type"), **entry)
+                for entry in entries
+            ]
+        except (OSError, ValueError, TypeError, KeyError):
+            return None
+
+    def _save_cached_resolution(self, cache_path: Path) -> None:
+        """Save the current resolution for reuse.
+
+        Args:
+            cache_path: Path to the cache file.
+        """
+        # Write to a temporary file first so an interrupted run never leaves
+        # truncated JSON behind
+        tmp_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path.write_bytes(dumps_json([p.to_dict() for p in self.resolved]))
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            # The cache is an optimization only; this is not a resolution error
+            with contextlib.suppress(OSError):
+                tmp_path.unlink(missing_ok=True)
+            print(f"Warning: could not write resolution cache: {e}", file=sys.stderr)
+
     def _get_available_updates(self) -> set[str]:
         """Get list of packages that have available updates.
 
@@ -108,32 +193,19 @@ class DependencyResolver:
         updates = set()
 
         try:
-            # Use dnf check-update to find available updates
+            # Ask dnf for upgradable package names directly in a stable format
             result = subprocess.run(
-                ["dnf", "check-update", "--quiet"],
+                ["dnf", "repoquery", "--upgrades", "--quiet", "--queryformat", "%{name}\n"],
                 capture_output=True,
                 text=True,
             )
 
-            # Exit code 100 means updates are available
-            if result.returncode not in (0, 100):
-                self.errors.append(f"dnf check-update failed: {result.stderr}")
+            if result.returncode != 0:
+                self.errors.append(f"dnf repoquery --upgrades failed: {result.stderr}")
                 return updates
 
-            for line in result.stdout.splitlines():
-                line = line.strip()
-                if not line or line.startswith("Obsoleting"):
-                    continue
-
-                parts = line.split()
-                if len(parts) >= 2:
-                    # Package name is first field (may include arch)
-                    pkg_with_arch = parts[0]
-                    pkg_name = pkg_with_arch.rsplit(".", 1)[0]
-
-                    # Only include if it's in our installed set
-                    if pkg_name in self.installed_packages:
-                        updates.add(pkg_name)
+            # Only include packages in our installed set
+            updates = set(result.stdout.split()) & self.installed_packages
 
         except subprocess.CalledProcessError as e:
             self.errors.append(f"Failed to check updates: {e}")
@@ -157,6 +229,7 @@ class DependencyResolver:
             )
 
             if result.returncode != 0:
+                self.errors.append(f"dnf updateinfo failed: {result.stderr}")
                 return security_pkgs
 
             for line in result.stdout.splitlines():
@@ -169,7 +242,7 @@ class DependencyResolver:
                     pkg_name = pkg_name.split("-")[0] if "-" in pkg_name else pkg_name
                     security_pkgs.add(pkg_name)
 
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
+        except subprocess.TimeoutExpired as e:
             self.errors.append(f"Failed to get security updates: {e}")
 
         return security_pkgs
@@ -243,82 +316,91 @@ class DependencyResolver:
             List of resolved packages.
         """
         resolved = []
-        processed = set()
-        to_process = list(packages)
+        seen_nevras: set[str] = set()
+        names = sorted(packages | self._get_dependency_closure(packages))
 
-        while to_process:
-            pkg_name = to_process.pop(0)
-            if pkg_name in processed:
+        try:
+            # Get latest version available for the whole closure at once
+            result = subprocess.run(
+                [
+                    "dnf", "repoquery",
+                    "--latest-limit=1",
+                    "--queryformat",
+                    "%{name}|%{epoch}|%{version}|%{release}|%{arch}|%{reponame}|%{size}\n",
+                ] + names,
+                capture_output=True,
+                text=True,
+                check=True,
+            )
+        except subprocess.CalledProcessError as e:
+            self.errors.append(f"Failed to query packages: {e}")
+            return resolved
+
+        for line in result.stdout.splitlines():
+            if not line.strip():
+                continue
+
+            parts = line.split("|")
+            if len(parts) < 7:
                 continue
-            processed.add(pkg_name)
-
-            try:
-                # Get latest version available
-                result = subprocess.run(
-                    [
-                        "dnf", "repoquery",
-                        "--latest-limit=1",
-                        "--queryformat",
-                        "%{name}|%{epoch}|%{version}|%{release}|%{arch}|%{reponame}|%{size}",
-                        pkg_name,
-                    ],
-                    capture_output=True,
-                    text=True,
-                    check=True,
-                )
-
-                for line in result.stdout.splitlines():
-                    if not line.strip():
-                        continue
-
-                    parts = line.split("|")
-                    if len(parts) < 7:
-                        continue
-
-                    name, epoch, version, release, arch, repo, size = parts[:7]
-
-                    # Skip if already resolved
-                    nevra = f"{name}-{epoch}:{version}-{release}.{arch}"
-                    if any(p.nevra == nevra for p in resolved):
-                        continue
-
-                    pkg = ResolvedPackage(
-                        name=name,
-                        epoch=epoch if epoch != "(none)" else "0",
-                        version=version,
-                        release=release,
-                        arch=arch,
-                        nevra=nevra,
-                        repo_id=repo,
-                        package_type="update" if name in packages else "dependency",
-                        size_bytes=int(size) if size.isdigit() else 0,
-                    )
-                    resolved.append(pkg)
-
-                # Get dependencies
-                dep_result = subprocess.run(
-                    [
-                        "dnf", "repoquery",
-                        "--requires",
-                        "--resolve",
-                        "--latest-limit=1",
-                        "--queryformat=%{name}",
-                        pkg_name,
-                    ],
-                    capture_output=True,
-                    text=True,
-                )
-
-                for dep_line in dep_result.stdout.splitlines():
-                    dep_name = dep_line.strip()
-                    if dep_name and dep_name not in processed:
-                        to_process.append(dep_name)
-
-            except subprocess.CalledProcessError:
+
+            name, epoch, version, release, arch, repo, size = parts[:7]
+
+            # Skip if already resolved
+            nevra = f"{name}-{epoch}:{version}-{release}.{arch}"
+            if nevra in seen_nevras:
                 continue
+            seen_nevras.add(nevra)
+
+            pkg = ResolvedPackage(
+                name=name,
+                epoch=epoch if epoch != "(none)" else "0",
+                version=version,
+                release=release,
+                arch=arch,
+                nevra=nevra,
+                repo_id=repo,
+                package_type="update" if name in packages else "dependency",
+                size_bytes=int(size) if size.isdigit() else 0,
+            )
+            resolved.append(pkg)
 
         return resolved
 
+    def _get_dependency_closure(self, packages: set[str]) -> set[str]:
+        """Get the names of all packages required by a set of packages.
+
+        Args:
+            packages: Set of package names.
+
+        Returns:
+            Set of dependency names, excluding the packages themselves.
+        """
+        key = frozenset(packages)
+        if key not in self._dep_cache:
+            # One recursive query instead of one dnf invocation per package
+            result = subprocess.run(
+                [
+                    "dnf", "repoquery",
+                    "--requires",
+                    "--resolve",
+                    "--recursive",
+                    "--latest-limit=1",
+                    "--queryformat=%{name}\n",
+                ] + sorted(packages),
+                capture_output=True,
+                text=True,
+            )
+
+            # Do not memoize a failed query; the closure would be incomplete
+            if result.returncode != 0:
+                self.errors.append(f"dnf repoquery --requires failed: {result.stderr}")
+                return set()
+
+            self._dep_cache[key] = set(result.stdout.split()) - packages
+
+        return self._dep_cache[key]
+
     def _parse_package_line(self, line: str) -> ResolvedPackage | None:
         """Parse a package line from dnf output.
 
@@ -386,19 +468,33 @@ class DependencyResolver:
         """
         path = Path(output_path)
 
+        # Accumulate counts, size and serialized packages in a single pass
+        update_count = security_count = dependency_count = 0
+        total_size = 0
+        packages = []
+        for p in self.resolved:
+            package_type = p.package_type
+            if package_type == "update":
+                update_count += 1
+            elif package_type == "security":
+                security_count += 1
+            elif package_type == "dependency":
+                dependency_count += 1
+            total_size += p.size_bytes
+            packages.append(p.to_dict())
+
         data = {
             "installed_count": len(self.installed_packages),
             "resolved_count": len(self.resolved),
-            "update_count": len([p for p in self.resolved if p.package_type == "update"]),
-            "security_count": len([p for p in self.resolved if p.package_type == "security"]),
-            "dependency_count": len([p for p in self.resolved if p.package_type == "dependency"]),
-            "total_size_bytes": sum(p.size_bytes for p in self.resolved),
-            "packages": [p.to_dict() for p in self.resolved],
+            "update_count": update_count,
+            "security_count": security_count,
+            "dependency_count": dependency_count,
+            "total_size_bytes": total_size,
+            "packages": packages,
             "errors": self.errors,
         }
 
-        with open(path, "w") as f:
-            json.dump(data, f, indent=2)
+        path.write_bytes(dumps_json(data, indent=True))
 
         return path
 
@@ -429,6 +525,10 @@ def main():
         action="store_true",
         help="Don't prefer security updates",
     )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory for caching resolution results between runs",
+    )
 
     args = parser.parse_args()
 
@@ -449,6 +549,7 @@ def main():
     resolver = DependencyResolver(
         list(packages),
         prefer_security=not args.no_security_preference,
+        cache_dir=args.cache_dir,
     )
 
     resolved = resolver.resolve()
@@ -6,18 +6,49 @@ Collects installed RPM information from a host and generates
 a canonical manifest JSON file.
 """
 
-import json
 import os
 import re
+import socket
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
+from itertools import islice
+from operator import itemgetter
 from pathlib import Path
 from typing import Any
 
+from .jsonio import dumps_json
+
+try:
+    import rpm
+except ImportError:  # python3-rpm unavailable, fall back to the rpm command
+    rpm = None
+
 COLLECTOR_VERSION = "1.0.0"
 SCHEMA_VERSION = "1.0"
 
+# Architecture suffix on dnf repo IDs, e.g. "epel/x86_64"
+_REPO_ARCH_RE = re.compile(r"/[a-z0-9_]+$")
+
+# Advisory IDs in RHSA, RHBA and RHEA format
+_ADVISORY_RE = re.compile(r"^(RH[SBAE]A-\d{4}:\d+)")
+
+# Names /etc/hosts commonly gives the loopback addresses
+_LOOPBACK_NAMES = frozenset({
+    "localhost",
+    "localhost.localdomain",
+    "localhost4",
+    "localhost4.localdomain4",
+    "localhost6",
+    "localhost6.localdomain6",
+    "ip6-localhost",
+    "ip6-loopback",
+})
+
+# KEY=value and KEY="value" lines in /etc/os-release
+_OS_RELEASE_RE = re.compile(r'^(\w+)=(?:"([^"]*)"|(\S*))', re.MULTILINE)
+
 
 class ManifestCollector:
     """Collect host manifest data for Policy B bundle building."""
@@ -30,6 +61,7 @@ class ManifestCollector:
         """
         self.output_dir = Path(output_dir) if output_dir else Path.cwd()
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.errors: list[str] = []
 
     def collect(self) -> dict[str, Any]:
         """Collect all manifest data from the current host.
@@ -37,22 +69,37 @@ class ManifestCollector:
         Returns:
             Complete manifest dictionary.
         """
+        self.errors = []
+
+        # The collectors are independent subprocess queries, so run them concurrently
+        collectors = {
+            "host_id": self._get_host_id,
+            "os": self._get_os_info,
+            "arch": self._get_arch,
+            "kernel_version": self._get_kernel_version,
+            "enabled_repos": self._get_enabled_repos,
+            "installed_rpms": self._get_installed_rpms,
+            "advisory_ids": self._get_applicable_advisories,
+        }
+        with ThreadPoolExecutor(max_workers=len(collectors)) as executor:
+            futures = {key: executor.submit(fn) for key, fn in collectors.items()}
+            results = {key: future.result() for key, future in futures.items()}
+
         manifest = {
             "schema_version": SCHEMA_VERSION,
-            "host_id": self._get_host_id(),
-            "os": self._get_os_info(),
-            "arch": self._get_arch(),
-            "kernel_version": self._get_kernel_version(),
-            "enabled_repos": self._get_enabled_repos(),
-            "installed_rpms": self._get_installed_rpms(),
+            "host_id": results["host_id"],
+            "os": results["os"],
+            "arch": results["arch"],
+            "kernel_version": results["kernel_version"],
+            "enabled_repos": results["enabled_repos"],
+            "installed_rpms": results["installed_rpms"],
             "timestamp": datetime.now(timezone.utc).isoformat(),
             "collector_version": COLLECTOR_VERSION,
         }
 
-        # Optionally collect advisory IDs if available
-        advisories = self._get_applicable_advisories()
-        if advisories:
-            manifest["advisory_ids"] = advisories
+        # Optionally include advisory IDs if available
+        if results["advisory_ids"]:
+            manifest["advisory_ids"] = results["advisory_ids"]
 
         return manifest
 
@@ -71,43 +118,31 @@ class ManifestCollector:
             filename = f"{manifest['host_id']}-manifest.json"
 
         output_path = self.output_dir / filename
-        with open(output_path, "w") as f:
-            json.dump(manifest, f, indent=2, sort_keys=True)
+        output_path.write_bytes(dumps_json(manifest, indent=True, sort_keys=True))
 
         return output_path
 
     def _get_host_id(self) -> str:
         """Get unique host identifier."""
-        # Prefer hostname, fall back to machine-id
-        try:
-            result = subprocess.run(
-                ["hostname", "-f"],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            hostname = result.stdout.strip()
-            if hostname:
-                return hostname
-        except subprocess.CalledProcessError:
-            pass
+        # Match `hostname -f`: use a dotted hostname as is, otherwise resolve it
+        hostname = socket.gethostname()
+        if "." in hostname:
+            return hostname
+
+        # A loopback line in /etc/hosts resolves the hostname to "localhost"
+        fqdn = socket.getfqdn(hostname)
+        if fqdn and fqdn not in _LOOPBACK_NAMES:
+            return fqdn
+
+        if hostname:
+            return hostname
 
         # Fall back to machine-id
         machine_id_path = Path("/etc/machine-id")
         if machine_id_path.exists():
             return machine_id_path.read_text().strip()[:12]
 
-        # Last resort: short hostname
-        try:
-            result = subprocess.run(
-                ["hostname"],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            return result.stdout.strip()
-        except subprocess.CalledProcessError:
-            return "unknown-host"
+        return "unknown-host"
 
     def _get_os_info(self) -> dict[str, Any]:
         """Get OS information from /etc/os-release."""
@@ -117,51 +152,36 @@ class ManifestCollector:
         if not os_release_path.exists():
             return os_info
 
-        content = os_release_path.read_text()
-
-        # Parse os-release file
-        for line in content.splitlines():
-            if "=" not in line:
-                continue
-            key, _, value = line.partition("=")
-            value = value.strip().strip('"')
-
-            if key == "NAME":
-                os_info["name"] = value
-            elif key == "ID":
-                os_info["id"] = value
-            elif key == "VERSION_ID":
-                parts = value.split(".")
-                os_info["major"] = int(parts[0])
-                if len(parts) > 1:
-                    os_info["minor"] = int(parts[1])
+        # Parse os-release file in a single pass
+        fields = {
+            key: quoted or bare
+            for key, quoted, bare in _OS_RELEASE_RE.findall(os_release_path.read_text())
+        }
+
+        if "NAME" in fields:
+            os_info["name"] = fields["NAME"]
+        if "ID" in fields:
+            os_info["id"] = fields["ID"]
+        if "VERSION_ID" in fields:
+            parts = fields["VERSION_ID"].split(".")
+            os_info["major"] = int(parts[0])
+            if len(parts) > 1:
+                os_info["minor"] = int(parts[1])
 
         return os_info
 
     def _get_arch(self) -> str:
         """Get system architecture."""
         try:
-            result = subprocess.run(
-                ["uname", "-m"],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            return result.stdout.strip()
-        except subprocess.CalledProcessError:
+            return os.uname().machine
+        except AttributeError:
             return "x86_64"
 
     def _get_kernel_version(self) -> str:
         """Get current kernel version."""
         try:
-            result = subprocess.run(
-                ["uname", "-r"],
-                capture_output=True,
-                text=True,
-                check=True,
-            )
-            return result.stdout.strip()
-        except subprocess.CalledProcessError:
+            return os.uname().release
+        except AttributeError:
             return "unknown"
 
     def _get_enabled_repos(self) -> list[dict[str, str]]:
@@ -185,7 +205,7 @@ class ManifestCollector:
                         repos.append(current_repo)
                     repo_id = line.split(":", 1)[1].strip()
                     # Remove architecture suffix if present
-                    repo_id = re.sub(r"/[a-z0-9_]+$", "", repo_id)
+                    repo_id = _REPO_ARCH_RE.sub("", repo_id)
                     current_repo = {"id": repo_id, "name": ""}
                 elif line.startswith("Repo-name") and current_repo:
                     current_repo["name"] = line.split(":", 1)[1].strip()
@@ -206,7 +226,7 @@ class ManifestCollector:
                     text=True,
                     check=True,
                 )
-                for line in result.stdout.splitlines()[1:]:  # Skip header
+                for line in islice(result.stdout.splitlines(), 1, None):  # Skip header
                     parts = line.split(None, 1)
                     if len(parts) >= 2:
                         repos.append({"id": parts[0], "name": parts[1].strip()})
@@ -219,60 +239,108 @@ class ManifestCollector:
         """Get list of all installed RPMs in NEVRA format."""
         rpms = []
 
-        try:
-            # Use rpm to get exact NEVRA information
-            result = subprocess.run(
-                [
-                    "rpm",
-                    "-qa",
-                    "--queryformat",
-                    "%{NAME}\\t%{EPOCH}\\t%{VERSION}\\t%{RELEASE}\\t%{ARCH}\\n",
-                ],
-                capture_output=True,
-                text=True,
-                check=True,
+        entries = self._query_rpmdb() if rpm is not None else None
+        if entries is None:
+            entries = self._query_rpm_command()
+
+        for name, epoch, version, release, arch in entries:
+            # Handle (none) epoch
+            if epoch == "(none)":
+                epoch = "0"
+
+            # Build NEVRA string, omitting a zero epoch
+            epoch_version = f"{epoch}:{version}" if epoch != "0" else version
+            nevra = f"{name}-{epoch_version}-{release}.{arch}"
+
+            rpms.append(
+                {
+                    "name": name,
+                    "epoch": epoch,
+                    "version": version,
+                    "release": release,
+                    "arch": arch,
+                    "nevra": nevra,
+                }
             )
 
-            for line in result.stdout.splitlines():
-                if not line.strip():
-                    continue
+        return sorted(rpms, key=itemgetter("name"))
+
+    def _query_rpmdb(self) -> list[tuple[str, str, str, str, str]] | None:
+        """Read installed package headers directly from the RPM database.
+
+        Returns:
+            List of (name, epoch, version, release, arch) tuples, or None if
+            the database could not be read.
+        """
+        tags = (
+            rpm.RPMTAG_NAME,
+            rpm.RPMTAG_EPOCH,
+            rpm.RPMTAG_VERSION,
+            rpm.RPMTAG_RELEASE,
+            rpm.RPMTAG_ARCH,
+        )
 
-                parts = line.split("\t")
+        try:
+            ts = rpm.TransactionSet()
+            return [
+                tuple(self._header_value(header[tag]) for tag in tags)
+                for header in ts.dbMatch()
+            ]
+        except rpm.error as e:
+            print(f"Error reading RPM database: {e}", file=sys.stderr)
+            return None
+
+    @staticmethod
+    def _header_value(value: Any) -> str:
+        """Convert an RPM header value to its rpm --queryformat text."""
+        if value is None:
+            return "(none)"
+        if isinstance(value, bytes):
+            return value.decode()
+        return str(value)
+
+    def _query_rpm_command(self) -> list[tuple[str, str, str, str, str]]:
+        """Query installed packages by running rpm -qa.
+
+        Returns:
+            List of (name, epoch, version, release, arch) tuples.
+        """
+        entries = []
+
+        # Use rpm to get exact NEVRA information, parsing lines as they arrive
+        cmd = [
+            "rpm",
+            "-qa",
+            "--queryformat",
+            "%{NAME}\\t%{EPOCH}\\t%{VERSION}\\t%{RELEASE}\\t%{ARCH}\\n",
+        ]
+        with subprocess.Popen(
+            cmd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ) as proc:
+            for line in proc.stdout:
+                parts = line.rstrip("\n").split("\t")
                 if len(parts) != 5:
                     continue
 
-                name, epoch, version, release, arch = parts
-
-                # Handle (none) epoch
-                if epoch == "(none)":
-                    epoch = "0"
-
-                # Build NEVRA string
-                if epoch != "0":
-                    nevra = f"{name}-{epoch}:{version}-{release}.{arch}"
-                else:
-                    nevra = f"{name}-{version}-{release}.{arch}"
-
-                rpms.append(
-                    {
-                        "name": name,
-                        "epoch": epoch,
-                        "version": version,
-                        "release": release,
-                        "arch": arch,
-                        "nevra": nevra,
-                    }
-                )
+                entries.append(tuple(parts))
 
-        except subprocess.CalledProcessError as e:
-            print(f"Error collecting RPM list: {e}", file=sys.stderr)
+        if proc.returncode != 0:
+            print(
+                f"Error collecting RPM list: rpm -qa exited with status {proc.returncode}",
+                file=sys.stderr,
+            )
+            return []
 
-        return sorted(rpms, key=lambda x: x["name"])
+        return entries
 
     def _get_applicable_advisories(self) -> list[str]:
         """Get list of applicable security advisories (if available)."""
-        advisories = []
+        advisories = set()
 
+        # Advisory collection is optional; record failures but don't fail
         try:
             result = subprocess.run(
                 ["dnf", "updateinfo", "list", "--security", "--available"],
@@ -280,19 +348,18 @@ class ManifestCollector:
                 text=True,
                 timeout=60,
             )
+        except subprocess.TimeoutExpired as e:
+            self.errors.append(f"Failed to get security advisories: {e}")
+            return []
 
-            if result.returncode == 0:
-                for line in result.stdout.splitlines():
-                    # Parse advisory IDs (RHSA, RHBA, RHEA format)
-                    match = re.match(r"^(RH[SBAE]A-\d{4}:\d+)", line)
-                    if match:
-                        advisory_id = match.group(1)
-                        if advisory_id not in advisories:
-                            advisories.append(advisory_id)
+        if result.returncode != 0:
+            self.errors.append(f"dnf updateinfo failed: {result.stderr}")
+            return []
 
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired):
-            # Advisory collection is optional, don't fail if it doesn't work
-            pass
+        for line in result.stdout.splitlines():
+            match = _ADVISORY_RE.match(line)
+            if match:
+                advisories.add(match.group(1))
 
         return sorted(advisories)
 
@@ -327,11 +394,14 @@ def main():
 
     if args.stdout:
         manifest = collector.collect()
-        print(json.dumps(manifest, indent=2, sort_keys=True))
+        print(dumps_json(manifest, indent=True, sort_keys=True).decode())
     else:
         output_path = collector.collect_and_save(filename=args.filename)
         print(f"Manifest written to: {output_path}")
 
+    for error in collector.errors:
+        print(f"Warning: {error}", file=sys.stderr)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,59 @@
+"""
+JSON encoding helpers shared by the manifest tools and the bundle builder.
+
+orjson is used when installed. The stdlib fallback is configured to produce
+the same bytes, so manifest hashes do not depend on which encoder ran.
+"""
+
+import json
+from typing import Any
+
+try:
+    import orjson
+except ImportError:  # orjson is an optional extra
+    orjson = None
+
+
+def dumps_json(obj: Any, indent: bool = False, sort_keys: bool = False) -> bytes:
+    """Serialize an object to UTF-8 JSON.
+
+    Args:
+        obj: JSON-compatible object. It must not contain cycles.
+        indent: Indent nested values by two spaces; otherwise compact.
+        sort_keys: Sort object keys.
+
+    Returns:
+        Encoded JSON, with non-ASCII characters written as raw UTF-8.
+    """
+    if orjson is not None:
+        option = (orjson.OPT_INDENT_2 if indent else 0) | (
+            orjson.OPT_SORT_KEYS if sort_keys else 0
+        )
+        return orjson.dumps(obj, option=option)
+
+    return json.dumps(
+        obj,
+        indent=2 if indent else None,
+        separators=None if indent else (",", ":"),
+        sort_keys=sort_keys,
+        ensure_ascii=False,
+        check_circular=False,
+    ).encode()
+
+
+def loads_json(data: bytes | str) -> Any:
+    """Parse JSON content.
+
+    Args:
+        data: JSON document.
+
+    Returns:
+        Parsed object.
+
+    Raises:
+        json.JSONDecodeError: If the content is not valid JSON. orjson's
+            error is a subclass.
+    """
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
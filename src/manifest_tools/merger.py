@@ -7,27 +7,51 @@ Merges multiple host manifests into a consolidated view per OS major version.
 
 import hashlib
 import json
+import marshal
+import os
+import sys
+import threading
 from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 from pathlib import Path
-from typing import Any
+from typing import Any, Callable
+
+from .jsonio import dumps_json, loads_json
 
 
 class ManifestMerger:
     """Merge multiple host manifests for bundle building."""
 
-    def __init__(self, os_major: int):
+    def __init__(self, os_major: int, cache_dir: str | Path | None = None):
         """Initialize the merger for a specific OS major version.
 
         Args:
             os_major: Target OS major version (8 or 9).
+            cache_dir: Directory for caching parsed manifests by content hash,
+                or None to disable. Entries are loaded with marshal, which is
+                not safe on untrusted data, so the directory must only be
+                writable by trusted users. Entries are never evicted.
         """
         if os_major not in (8, 9):
             raise ValueError(f"OS major version must be 8 or 9, got: {os_major}")
 
         self.os_major = os_major
+        self.cache_dir = Path(cache_dir) if cache_dir is not None else None
         self.manifests: list[dict[str, Any]] = []
         self.manifest_hashes: dict[str, str] = {}
+        self._seen_hashes: set[str] = set()
+        # Manifests skipped because identical bytes were already added
+        self.duplicate_count = 0
+        # Per-host (host_id, names, nevras) columns of installed RPMs
+        self._rpm_columns: list[tuple[str, list[str], list[str]]] = []
+        # Host summary fields, one list per column in manifest order
+        self._host_ids: list[str] = []
+        self._os_minors: list[int] = []
+        self._archs: list[str] = []
+        self._installed_counts: list[int] = []
+        self._timestamps: list[str] = []
+        self._cache: dict[str, Any] = {}
 
     def add_manifest(self, manifest_path: str | Path) -> bool:
         """Add a manifest file to the merger.
@@ -39,28 +63,168 @@ class ManifestMerger:
             True if manifest was added (correct OS version), False otherwise.
         """
         path = Path(manifest_path)
+        manifest, manifest_hash = self._load_manifest(path)
+        return self._install_manifest(path.stem, manifest, manifest_hash)
+
+    def add_manifest_bytes(self, data: bytes, source: str = "<memory>") -> bool:
+        """Add a manifest from its raw JSON bytes.
+
+        Args:
+            data: Manifest JSON content.
+            source: Host ID to use if the manifest does not have one.
+
+        Returns:
+            True if manifest was added (correct OS version), False otherwise.
+        """
+        manifest, manifest_hash = self._parse_manifest(data)
+        return self._install_manifest(source, manifest, manifest_hash)
+
+    def add_manifest_dict(
+        self, manifest: dict[str, Any], source: str = "<memory>"
+    ) -> bool:
+        """Add an already parsed manifest.
+
+        The manifest hash is taken over its canonical JSON encoding (sorted
+        keys, compact separators, UTF-8), so it will not match the hash of a
+        file with different formatting.
 
-        with open(path) as f:
-            manifest = json.load(f)
+        Args:
+            manifest: Manifest dictionary.
+            source: Host ID to use if the manifest does not have one.
+
+        Returns:
+            True if manifest was added (correct OS version), False otherwise.
+        """
+        canonical = dumps_json(manifest, sort_keys=True)
+        manifest_hash = hashlib.sha256(canonical).hexdigest()
+        return self._install_manifest(source, manifest, manifest_hash)
 
+    def _load_manifest(self, path: Path) -> tuple[dict[str, Any], str]:
+        """Read, parse and hash a manifest file without modifying the merger.
+
+        Args:
+            path: Path to manifest JSON file.
+
+        Returns:
+            Tuple of (parsed manifest, SHA256 of the file).
+        """
+        return self._parse_manifest(path.read_bytes())
+
+    def _parse_manifest(self, raw: bytes) -> tuple[dict[str, Any], str]:
+        """Parse and hash manifest bytes without modifying the merger.
+
+        Args:
+            raw: Manifest JSON content.
+
+        Returns:
+            Tuple of (parsed manifest, SHA256 of the content).
+        """
+        # Hash the file as shipped for deduplication and tracking
+        manifest_hash = hashlib.sha256(raw).hexdigest()
+
+        if self.cache_dir is None:
+            return loads_json(raw), manifest_hash
+
+        # Parsed manifests are cached by content hash, so entries never go
+        # stale. A missing, truncated or corrupt entry is re-parsed and
+        # overwritten.
+        cache_path = self.cache_dir / f"{manifest_hash}.v{marshal.version}.marshal"
+        try:
+            cached = marshal.loads(cache_path.read_bytes())
+        except (OSError, EOFError, ValueError, TypeError):
+            cached = None
+        if isinstance(cached, dict):
+            return cached, manifest_hash
+
+        manifest = loads_json(raw)
+        try:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+            tmp_path = cache_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+            tmp_path.write_bytes(marshal.dumps(manifest))
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            # The cache is an optimization only
+            pass
+
+        return manifest, manifest_hash
+
+    def _try_load_manifest(self, path: Path) -> tuple[dict[str, Any], str] | None:
+        """Load a file that may not be a manifest.
+
+        Args:
+            path: Path to JSON file.
+
+        Returns:
+            Tuple of (parsed manifest, SHA256 of the file), or None if the
+            file could not be parsed.
+        """
+        try:
+            return self._load_manifest(path)
+        except (json.JSONDecodeError, KeyError):
+            return None
+
+    def _install_manifest(
+        self, default_host_id: str, manifest: dict[str, Any], manifest_hash: str
+    ) -> bool:
+        """Add a parsed manifest if it matches the target OS version.
+
+        Args:
+            default_host_id: Host ID to use if the manifest does not have one.
+            manifest: Parsed manifest dictionary.
+            manifest_hash: SHA256 of the manifest file.
+
+        Returns:
+            True if manifest was added, False if it is for another OS version
+            or is byte-identical to a manifest already added (counted in
+            duplicate_count).
+        """
         # Verify OS major version matches
         manifest_os_major = manifest.get("os", {}).get("major")
         if manifest_os_major != self.os_major:
             return False
 
-        # Calculate hash for deduplication and tracking
-        manifest_json = json.dumps(manifest, sort_keys=True)
-        manifest_hash = hashlib.sha256(manifest_json.encode()).hexdigest()
+        # Identical bytes include the host ID, so this is the same manifest again
+        if manifest_hash in self._seen_hashes:
+            self.duplicate_count += 1
+            return False
+        self._seen_hashes.add(manifest_hash)
 
-        host_id = manifest.get("host_id", path.stem)
+        host_id = manifest.get("host_id", default_host_id)
         self.manifest_hashes[host_id] = f"sha256:{manifest_hash}"
         self.manifests.append(manifest)
 
+        # Intern names and NEVRAs, in the manifest too, so hosts share one
+        # copy of each string
+        intern = sys.intern
+        names = []
+        nevras = []
+        for rpm in manifest.get("installed_rpms", []):
+            name = rpm.get("name", "")
+            if name:
+                name = rpm["name"] = intern(name)
+            nevra = rpm.get("nevra", "")
+            if nevra:
+                nevra = rpm["nevra"] = intern(nevra)
+            names.append(name)
+            nevras.append(nevra)
+
+        summary_host_id = manifest.get("host_id", "unknown")
+        self._rpm_columns.append((summary_host_id, names, nevras))
+        self._host_ids.append(summary_host_id)
+        self._os_minors.append(manifest["os"].get("minor", 0))
+        self._archs.append(manifest.get("arch", "x86_64"))
+        self._installed_counts.append(len(names))
+        self._timestamps.append(manifest.get("timestamp", ""))
+        self._cache.clear()
+
         return True
 
     def add_manifests_from_directory(self, directory: str | Path) -> int:
         """Add all manifest files from a directory.
 
+        Files are read, parsed and hashed concurrently, then added in
+        directory order.
+
         Args:
             directory: Directory containing manifest JSON files.
 
@@ -70,68 +234,119 @@ class ManifestMerger:
         directory = Path(directory)
         count = 0
 
-        for manifest_file in directory.glob("*-manifest.json"):
-            if self.add_manifest(manifest_file):
-                count += 1
-
+        manifest_files: list[Path] = []
         # Also try .json files that might be manifests
-        for manifest_file in directory.glob("*.json"):
-            if "-manifest" not in manifest_file.name:
-                try:
-                    if self.add_manifest(manifest_file):
-                        count += 1
-                except (json.JSONDecodeError, KeyError):
+        other_files: list[Path] = []
+
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                name = entry.name
+                if name.startswith(".") or not name.endswith(".json"):
                     continue
+                if not entry.is_file():
+                    continue
+                if name.endswith("-manifest.json"):
+                    manifest_files.append(Path(entry.path))
+                elif "-manifest" not in name:
+                    other_files.append(Path(entry.path))
+
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            manifests = executor.map(self._load_manifest, manifest_files)
+            others = executor.map(self._try_load_manifest, other_files)
+
+            for path, loaded in zip(manifest_files, manifests):
+                if self._install_manifest(path.stem, *loaded):
+                    count += 1
+
+            for path, loaded in zip(other_files, others):
+                if loaded is not None and self._install_manifest(path.stem, *loaded):
+                    count += 1
 
         return count
 
-    def get_merged_installed_rpms(self) -> dict[str, set[str]]:
-        """Get union of all installed RPMs across all hosts.
+    def _cached(self, key: str, compute: Callable[[], Any]) -> Any:
+        """Return a cached aggregate, computing it on first use.
+
+        The cache is cleared whenever a manifest is added.
+
+        Args:
+            key: Cache key for the aggregate.
+            compute: Function that builds the aggregate.
 
         Returns:
-            Dictionary mapping package name to set of NEVRAs seen.
+            The cached aggregate.
         """
-        all_packages: dict[str, set[str]] = defaultdict(set)
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
 
-        for manifest in self.manifests:
-            for rpm in manifest.get("installed_rpms", []):
-                name = rpm.get("name", "")
-                nevra = rpm.get("nevra", "")
-                if name and nevra:
-                    all_packages[name].add(nevra)
+    def get_merged_installed_rpms(self) -> dict[str, set[str]]:
+        """Get union of all installed RPMs across all hosts.
 
-        return dict(all_packages)
+        Returns:
+            Dictionary mapping package name to set of NEVRAs seen. The
+            result is a copy and may be modified by the caller.
+        """
+        merged_rpms = self._cached("rpms", self._aggregate_rpms)["merged_rpms"]
+        return {name: set(nevras) for name, nevras in merged_rpms.items()}
 
     def get_package_to_hosts_map(self) -> dict[str, list[str]]:
         """Get mapping of package names to host IDs that have them installed.
 
         Returns:
-            Dictionary mapping package name to list of host IDs.
+            Dictionary mapping package name to list of host IDs. The result
+            is a copy and may be modified by the caller.
         """
+        package_hosts = self._cached("rpms", self._aggregate_rpms)["package_hosts"]
+        return {name: list(hosts) for name, hosts in package_hosts.items()}
+
+    def _aggregate_rpms(self) -> dict[str, Any]:
+        """Build all installed-RPM aggregates in a single pass.
+
+        Returns:
+            Dictionary with the merged NEVRA union, the package to hosts
+            map and the total number of package instances.
+        """
+        all_packages: dict[str, set[str]] = defaultdict(set)
         package_hosts: dict[str, list[str]] = defaultdict(list)
+        instances = 0
 
-        for manifest in self.manifests:
-            host_id = manifest.get("host_id", "unknown")
-            for rpm in manifest.get("installed_rpms", []):
-                name = rpm.get("name", "")
-                if name:
-                    package_hosts[name].append(host_id)
+        for host_id, names, nevras in self._rpm_columns:
+            for name, nevra in zip(names, nevras):
+                if not name:
+                    continue
 
-        return dict(package_hosts)
+                package_hosts[name].append(host_id)
+                instances += 1
+
+                if nevra:
+                    all_packages[name].add(nevra)
+
+        return {
+            "merged_rpms": dict(all_packages),
+            "package_hosts": dict(package_hosts),
+            "package_instances": instances,
+        }
 
     def get_enabled_repos_union(self) -> list[dict[str, str]]:
         """Get union of all enabled repositories across hosts.
 
         Returns:
-            List of unique repositories.
+            List of unique repositories. The result is a copy and may be
+            modified by the caller.
         """
+        repos = self._cached("enabled_repos", self._union_enabled_repos)
+        return [dict(repo) for repo in repos]
+
+    def _union_enabled_repos(self) -> list[dict[str, str]]:
+        """Build the list of unique enabled repositories."""
         repos_seen: dict[str, dict[str, str]] = {}
 
         for manifest in self.manifests:
-            for repo in manifest.get("enabled_repos", []):
-                repo_id = repo.get("id", "")
-                if repo_id and repo_id not in repos_seen:
-                    repos_seen[repo_id] = repo
+            for repo in manifest.get("enabled_repos", ()):
+                repo_id = repo.get("id")
+                if repo_id:
+                    repos_seen.setdefault(repo_id, repo)
 
         return list(repos_seen.values())
 
@@ -139,24 +354,33 @@ class ManifestMerger:
         """Get summary information for all hosts in the merge.
 
         Returns:
-            List of host summaries.
+            List of host summaries. The result is a copy and may be
+            modified by the caller.
         """
-        summaries = []
-
-        for manifest in self.manifests:
-            host_id = manifest.get("host_id", "unknown")
-            summaries.append(
-                {
-                    "host_id": host_id,
-                    "manifest_hash": self.manifest_hashes.get(host_id, ""),
-                    "os_minor": manifest.get("os", {}).get("minor", 0),
-                    "arch": manifest.get("arch", "x86_64"),
-                    "installed_count": len(manifest.get("installed_rpms", [])),
-                    "timestamp": manifest.get("timestamp", ""),
-                }
+        summaries = self._cached("host_summary", self._summarize_hosts)
+        return [dict(summary) for summary in summaries]
+
+    def _summarize_hosts(self) -> list[dict[str, Any]]:
+        """Build the per-host summaries."""
+        manifest_hashes = self.manifest_hashes
+
+        return [
+            {
+                "host_id": host_id,
+                "manifest_hash": manifest_hashes.get(host_id, ""),
+                "os_minor": os_minor,
+                "arch": arch,
+                "installed_count": installed_count,
+                "timestamp": timestamp,
+            }
+            for host_id, os_minor, arch, installed_count, timestamp in zip(
+                self._host_ids,
+                self._os_minors,
+                self._archs,
+                self._installed_counts,
+                self._timestamps,
             )
-
-        return summaries
+        ]
 
     def generate_merge_report(self) -> dict[str, Any]:
         """Generate a complete merge report.
@@ -164,15 +388,14 @@ class ManifestMerger:
         Returns:
             Merge report dictionary.
         """
-        merged_rpms = self.get_merged_installed_rpms()
-        package_hosts = self.get_package_to_hosts_map()
+        rpms = self._cached("rpms", self._aggregate_rpms)
 
         return {
             "os_major": self.os_major,
-            "manifest_count": len(self.manifests),
+            "manifest_count": len(self._host_ids),
             "hosts": self.get_host_summary(),
-            "unique_packages": len(merged_rpms),
-            "total_package_instances": sum(len(hosts) for hosts in package_hosts.values()),
+            "unique_packages": len(rpms["merged_rpms"]),
+            "total_package_instances": rpms["package_instances"],
             "enabled_repos": self.get_enabled_repos_union(),
             "generated_at": datetime.now(timezone.utc).isoformat(),
         }
@@ -187,14 +410,11 @@ class ManifestMerger:
             Path to the exported file.
         """
         path = Path(output_path)
-        merged_rpms = self.get_merged_installed_rpms()
-
-        # Create a sorted list of unique package names
-        packages = sorted(merged_rpms.keys())
+        merged_rpms = self._cached("rpms", self._aggregate_rpms)["merged_rpms"]
 
-        with open(path, "w") as f:
-            for package in packages:
-                f.write(f"{package}\n")
+        # Write the sorted unique package names in a single call
+        packages = sorted(merged_rpms)
+        path.write_text("\n".join(packages) + "\n" if packages else "")
 
         return path
 
@@ -227,31 +447,40 @@ def main():
         "--package-list",
         help="Output file for merged package list",
     )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory for caching parsed manifests between runs (must be trusted)",
+    )
 
     args = parser.parse_args()
 
-    merger = ManifestMerger(os_major=args.os_major)
+    merger = ManifestMerger(os_major=args.os_major, cache_dir=args.cache_dir)
 
     for manifest_path in args.manifests:
         path = Path(manifest_path)
+        duplicates = merger.duplicate_count
         if path.is_dir():
             count = merger.add_manifests_from_directory(path)
             print(f"Added {count} manifests from {path}")
+            skipped = merger.duplicate_count - duplicates
+            if skipped:
+                print(f"Skipped {skipped} duplicate manifests in {path}")
         elif path.is_file():
             if merger.add_manifest(path):
                 print(f"Added manifest: {path}")
+            elif merger.duplicate_count > duplicates:
+                print(f"Skipped (duplicate): {path}")
             else:
                 print(f"Skipped (wrong OS version): {path}")
 
     report = merger.generate_merge_report()
-    report_json = json.dumps(report, indent=2)
+    report_json = dumps_json(report, indent=True)
 
     if args.output:
-        with open(args.output, "w") as f:
-            f.write(report_json)
+        Path(args.output).write_bytes(report_json)
         print(f"Merge report written to: {args.output}")
     else:
-        print(report_json)
+        print(report_json.decode())
 
     if args.package_list:
         merger.export_package_list(args.package_list)
@@ -6,15 +6,26 @@ Validates manifest files against the canonical schema.
 """
 
 import json
+import re
 import sys
+from itertools import islice
 from pathlib import Path
 from typing import Any
 
+from .jsonio import loads_json
+
+# RFC 3339 date-time, as required by the manifest schema
+_TIMESTAMP_RE = re.compile(
+    r"\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(?:\.\d+)?(?:Z|[+-]\d{2}:?\d{2})"
+)
+
 
 class ManifestValidator:
     """Validate host manifests against the schema."""
 
-    REQUIRED_FIELDS = [
+    # Field tuples keep error messages in schema order; the frozensets are
+    # used for the membership checks themselves.
+    REQUIRED_FIELDS = (
         "schema_version",
         "host_id",
         "os",
@@ -22,18 +33,27 @@ class ManifestValidator:
         "enabled_repos",
         "installed_rpms",
         "timestamp",
-    ]
+    )
+    REQUIRED_FIELD_SET = frozenset(REQUIRED_FIELDS)
 
-    REQUIRED_OS_FIELDS = ["major", "minor", "name"]
-    REQUIRED_RPM_FIELDS = ["name", "epoch", "version", "release", "arch"]
-    VALID_ARCHES = ["x86_64", "aarch64", "noarch", "i686"]
-    VALID_OS_MAJORS = [8, 9]
+    REQUIRED_OS_FIELDS = ("major", "minor", "name")
+    REQUIRED_OS_FIELD_SET = frozenset(REQUIRED_OS_FIELDS)
+    REQUIRED_RPM_FIELDS = ("name", "epoch", "version", "release", "arch")
+    REQUIRED_RPM_FIELD_SET = frozenset(REQUIRED_RPM_FIELDS)
+    VALID_ARCHES = frozenset(("x86_64", "aarch64", "noarch", "i686"))
+    VALID_SYSTEM_ARCHES = frozenset(("x86_64", "aarch64"))
+    VALID_OS_MAJORS = frozenset((8, 9))
 
     def __init__(self):
         """Initialize the validator."""
         self.errors: list[str] = []
         self.warnings: list[str] = []
 
+    @property
+    def errors_text(self) -> str:
+        """Errors from the last validation, one per line."""
+        return "\n".join(self.errors)
+
     def validate(self, manifest: dict[str, Any]) -> bool:
         """Validate a manifest dictionary.
 
@@ -69,22 +89,38 @@ class ManifestValidator:
 
         if not path.exists():
             self.errors = [f"File not found: {path}"]
+            self.warnings = []
             return False
 
+        return self.validate_bytes(path.read_bytes())
+
+    def validate_bytes(self, data: bytes) -> bool:
+        """Validate manifest JSON content.
+
+        Args:
+            data: Manifest JSON content.
+
+        Returns:
+            True if valid, False otherwise.
+        """
         try:
-            with open(path) as f:
-                manifest = json.load(f)
-        except json.JSONDecodeError as e:
+            manifest = loads_json(data)
+        except json.JSONDecodeError as e:  # orjson's error is a subclass
             self.errors = [f"Invalid JSON: {e}"]
+            self.warnings = []
             return False
 
         return self.validate(manifest)
 
     def _validate_required_fields(self, manifest: dict[str, Any]) -> None:
         """Check for required top-level fields."""
-        for field in self.REQUIRED_FIELDS:
-            if field not in manifest:
-                self.errors.append(f"Missing required field: {field}")
+        missing = self.REQUIRED_FIELD_SET.difference(manifest)
+        if missing:
+            self.errors.extend(
+                f"Missing required field: {field}"
+                for field in self.REQUIRED_FIELDS
+                if field in missing
+            )
 
     def _validate_schema_version(self, manifest: dict[str, Any]) -> None:
         """Validate schema version."""
@@ -98,12 +134,18 @@ class ManifestValidator:
         """Validate OS information."""
         os_info = manifest.get("os", {})
 
-        for field in self.REQUIRED_OS_FIELDS:
-            if field not in os_info:
-                self.errors.append(f"Missing required os field: {field}")
+        missing = self.REQUIRED_OS_FIELD_SET.difference(os_info)
+        if missing:
+            self.errors.extend(
+                f"Missing required os field: {field}"
+                for field in self.REQUIRED_OS_FIELDS
+                if field in missing
+            )
 
         major = os_info.get("major")
-        if major is not None and major not in self.VALID_OS_MAJORS:
+        if major is not None and (
+            not isinstance(major, int) or major not in self.VALID_OS_MAJORS
+        ):
             self.errors.append(
                 f"Invalid OS major version: {major} (expected 8 or 9)"
             )
@@ -115,7 +157,7 @@ class ManifestValidator:
     def _validate_arch(self, manifest: dict[str, Any]) -> None:
         """Validate architecture."""
         arch = manifest.get("arch")
-        if arch and arch not in ["x86_64", "aarch64"]:
+        if arch and (not isinstance(arch, str) or arch not in self.VALID_SYSTEM_ARCHES):
             self.errors.append(
                 f"Invalid system architecture: {arch} (expected x86_64 or aarch64)"
             )
@@ -128,15 +170,18 @@ class ManifestValidator:
             self.errors.append("enabled_repos must be a list")
             return
 
+        error = self.errors.append
+        warn = self.warnings.append
+
         for i, repo in enumerate(repos):
             if not isinstance(repo, dict):
-                self.errors.append(f"enabled_repos[{i}] must be an object")
+                error(f"enabled_repos[{i}] must be an object")
                 continue
 
             if "id" not in repo:
-                self.errors.append(f"enabled_repos[{i}] missing required field: id")
+                error(f"enabled_repos[{i}] missing required field: id")
             if "name" not in repo:
-                self.warnings.append(f"enabled_repos[{i}] missing field: name")
+                warn(f"enabled_repos[{i}] missing field: name")
 
     def _validate_rpms(self, manifest: dict[str, Any]) -> None:
         """Validate installed RPMs list."""
@@ -151,24 +196,30 @@ class ManifestValidator:
             return
 
         # Sample validation (don't validate every single RPM for performance)
-        sample_size = min(len(rpms), 100)
-        for i in range(sample_size):
-            rpm = rpms[i]
+        error = self.errors.append
+        warn = self.warnings.append
+        extend_errors = self.errors.extend
+        required = self.REQUIRED_RPM_FIELD_SET
+        valid_arches = self.VALID_ARCHES
+
+        for i, rpm in enumerate(islice(rpms, 100)):
             if not isinstance(rpm, dict):
-                self.errors.append(f"installed_rpms[{i}] must be an object")
+                error(f"installed_rpms[{i}] must be an object")
                 continue
 
-            for field in self.REQUIRED_RPM_FIELDS:
-                if field not in rpm:
-                    self.errors.append(
-                        f"installed_rpms[{i}] missing required field: {field}"
-                    )
+            missing = required.difference(rpm)
+            if missing:
+                extend_errors(
+                    f"installed_rpms[{i}] missing required field: {field}"
+                    for field in self.REQUIRED_RPM_FIELDS
+                    if field in missing
+                )
 
             rpm_arch = rpm.get("arch", "")
-            if rpm_arch and rpm_arch not in self.VALID_ARCHES:
-                self.warnings.append(
-                    f"installed_rpms[{i}] has unusual arch: {rpm_arch}"
-                )
+            if rpm_arch and (
+                not isinstance(rpm_arch, str) or rpm_arch not in valid_arches
+            ):
+                warn(f"installed_rpms[{i}] has unusual arch: {rpm_arch}")
 
     def _validate_timestamp(self, manifest: dict[str, Any]) -> None:
         """Validate timestamp format."""
@@ -176,13 +227,14 @@ class ManifestValidator:
         if not timestamp:
             return
 
-        # Basic ISO 8601 format check
-        if not isinstance(timestamp, str):
+        # ISO 8601 date-time with a UTC offset; JSON non-strings raise TypeError
+        try:
+            match = _TIMESTAMP_RE.fullmatch(timestamp)
+        except TypeError:
             self.errors.append("timestamp must be a string")
             return
 
-        # Check for basic datetime format
-        if "T" not in timestamp:
+        if not match:
             self.errors.append(
                 f"timestamp must be ISO 8601 format, got: {timestamp}"
             )
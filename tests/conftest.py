@@ -1,13 +1,15 @@
 """Pytest configuration and fixtures."""
 
+import copy
 import json
 import pytest
+import shutil
 from pathlib import Path
 
 
-@pytest.fixture
-def sample_manifest():
-    """Return a sample valid manifest."""
+@pytest.fixture(scope="session")
+def sample_manifest_data():
+    """Return the shared sample valid manifest; tests must not mutate it."""
     return {
         "schema_version": "1.0",
         "host_id": "test-host-01",
@@ -54,9 +56,9 @@ def sample_manifest():
     }
 
 
-@pytest.fixture
-def sample_manifest_rhel8():
-    """Return a sample RHEL 8 manifest."""
+@pytest.fixture(scope="session")
+def sample_manifest_rhel8_data():
+    """Return the shared sample RHEL 8 manifest; tests must not mutate it."""
     return {
         "schema_version": "1.0",
         "host_id": "test-host-rhel8",
@@ -87,17 +89,38 @@ def sample_manifest_rhel8():
 
 
 @pytest.fixture
-def manifest_dir(tmp_path, sample_manifest, sample_manifest_rhel8):
-    """Create a temporary directory with test manifests."""
-    manifest_path = tmp_path / "manifests"
-    manifest_path.mkdir()
-    
-    # Write RHEL 9 manifest
-    with open(manifest_path / "test-host-01-manifest.json", "w") as f:
-        json.dump(sample_manifest, f)
-    
-    # Write RHEL 8 manifest
-    with open(manifest_path / "test-host-rhel8-manifest.json", "w") as f:
-        json.dump(sample_manifest_rhel8, f)
-    
+def sample_manifest(sample_manifest_data):
+    """Return a sample valid manifest."""
+    return copy.deepcopy(sample_manifest_data)
+
+
+@pytest.fixture
+def sample_manifest_rhel8(sample_manifest_rhel8_data):
+    """Return a sample RHEL 8 manifest."""
+    return copy.deepcopy(sample_manifest_rhel8_data)
+
+
+@pytest.fixture(scope="session")
+def manifest_files(sample_manifest_data, sample_manifest_rhel8_data):
+    """Return serialized test manifests keyed by file name."""
+    return {
+        "test-host-01-manifest.json": json.dumps(sample_manifest_data).encode(),
+        "test-host-rhel8-manifest.json": json.dumps(sample_manifest_rhel8_data).encode(),
+    }
+
+
+@pytest.fixture(scope="session")
+def manifest_dir(tmp_path_factory, manifest_files):
+    """Create a shared directory with test manifests; tests must not modify it."""
+    manifest_path = tmp_path_factory.mktemp("manifests")
+
+    for name, data in manifest_files.items():
+        (manifest_path / name).write_bytes(data)
+
     return manifest_path
+
+
+@pytest.fixture
+def writable_manifest_dir(tmp_path, manifest_dir):
+    """Return a private copy of the test manifest directory."""
+    return Path(shutil.copytree(manifest_dir, tmp_path / "manifests"))
@@ -1,14 +1,20 @@
 """Tests for bundle builder components."""
 
+import errno
+import io
+import json
+import logging
+import os
+import re
+import subprocess
+import tarfile
 import pytest
-from pathlib import Path
 from unittest.mock import patch, MagicMock
 
-import sys
-sys.path.insert(0, str(Path(__file__).parent.parent))
-
 from src.bundle_builder.resolver import DependencyResolver, ResolvedPackage
 from src.bundle_builder.downloader import RPMDownloader
+from src.bundle_builder.builder import BundleBuilder
+from src.bundle_builder.hashing import sha256_file
 
 
 class TestResolvedPackage:
@@ -73,17 +79,179 @@ class TestDependencyResolver:
     def test_get_available_updates_found(self, mock_run):
         """Test when updates are available."""
         mock_run.return_value = MagicMock(
-            returncode=100,
-            stdout="bash.x86_64    5.1.8-7.el9    rhel-9-baseos\nkernel.x86_64  5.14.0-428.el9 rhel-9-baseos\n",
+            returncode=0,
+            stdout="bash\nkernel\nopenssl\n",
             stderr=""
         )
         
         resolver = DependencyResolver(["bash", "kernel"])
         updates = resolver._get_available_updates()
         
-        assert "bash" in updates
-        assert "kernel" in updates
+        assert updates == {"bash", "kernel"}
+
+    @patch("subprocess.run")
+    def test_resolve_via_repoquery_batches_queries(self, mock_run):
+        """Test that the closure is resolved with two dnf invocations."""
+        mock_run.side_effect = [
+            MagicMock(returncode=0, stdout="glibc\nbash\n", stderr=""),
+            MagicMock(
+                returncode=0,
+                stdout=(
+                    "bash|0|5.1.8|9.el9|x86_64|baseos|1800000\n"
+                    "glibc|0|2.34|100.el9|x86_64|baseos|2000000\n"
+                ),
+                stderr="",
+            ),
+        ]
+
+        resolver = DependencyResolver(["bash"])
+        resolved = resolver._resolve_via_repoquery({"bash"})
+
+        assert mock_run.call_count == 2
+        assert {p.name: p.package_type for p in resolved} == {
+            "bash": "update",
+            "glibc": "dependency",
+        }
+
+        # Dependency closure is memoized
+        assert resolver._get_dependency_closure({"bash"}) == {"glibc"}
+        assert mock_run.call_count == 2
+
+    @patch("subprocess.run")
+    def test_dependency_closure_failure_not_cached(self, mock_run, tmp_path):
+        """Test that a failed dependency query is reported and not reused."""
+        def fake_run(cmd, **kwargs):
+            if "--upgrades" in cmd:
+                return MagicMock(returncode=0, stdout="bash\n", stderr="")
+            if "--requires" in cmd:
+                return MagicMock(returncode=1, stdout="", stderr="metadata error")
+            if "repoquery" in cmd:
+                return MagicMock(
+                    returncode=0,
+                    stdout="bash|0|5.1.8|9.el9|x86_64|baseos|1800000\n",
+                    stderr="",
+                )
+            return MagicMock(returncode=1, stdout="", stderr="")
+
+        mock_run.side_effect = fake_run
+
+        resolver = DependencyResolver(["bash"], prefer_security=False, cache_dir=tmp_path)
+        resolver.resolve()
+
+        assert any("--requires failed" in e for e in resolver.errors)
+        assert resolver._dep_cache == {}
+        assert list(tmp_path.iterdir()) == []
+
+    @patch("subprocess.run")
+    def test_resolve_without_updates_skips_security_query(self, mock_run):
+        """Test that no security query is started when nothing can be upgraded."""
+        mock_run.return_value = MagicMock(returncode=0, stdout="", stderr="")
+
+        resolver = DependencyResolver(["bash"])
+
+        assert resolver.resolve() == []
+        assert mock_run.call_count == 1
+        assert "--upgrades" in mock_run.call_args.args[0]
+
+    @patch("subprocess.run")
+    def test_get_security_updates_failure(self, mock_run):
+        """Test that a failed updateinfo query is reported and retried."""
+        mock_run.return_value = MagicMock(returncode=1, stdout="", stderr="no metadata")
+        resolver = DependencyResolver(["bash"])
+
+        assert resolver._get_security_updates() == set()
+        assert resolver.errors == ["dnf updateinfo failed: no metadata"]
+
+        mock_run.return_value = MagicMock(
+            returncode=0,
+            stdout="RHSA-2024:0001 Important/Sec. bash-5.1.8-9.el9.x86_64\n",
+            stderr="",
+        )
+        assert resolver._get_security_updates() == {"bash"}
+        assert mock_run.call_args.kwargs["timeout"] == 120
+
+    @patch("subprocess.run")
+    def test_resolve_classifies_security_updates(self, mock_run):
+        """Test resolution with the security query running concurrently."""
+        def fake_run(cmd, **kwargs):
+            if "--upgrades" in cmd:
+                return MagicMock(returncode=0, stdout="bash\n", stderr="")
+            if "updateinfo" in cmd:
+                return MagicMock(
+                    returncode=0,
+                    stdout="RHSA-2024:0001 Important/Sec. bash-5.1.8-9.el9.x86_64\n",
+                    stderr="",
+                )
+            if "--requires" in cmd:
+                return MagicMock(returncode=0, stdout="", stderr="")
+            if "repoquery" in cmd:
+                return MagicMock(
+                    returncode=0,
+                    stdout="bash|0|5.1.8|9.el9|x86_64|baseos|1800000\n",
+                    stderr="",
+                )
+            return MagicMock(returncode=1, stdout="", stderr="")
+
+        mock_run.side_effect = fake_run
+
+        resolver = DependencyResolver(["bash"])
+        resolved = resolver.resolve()
+
+        assert [(p.name, p.package_type) for p in resolved] == [("bash", "security")]
+
+    @patch("subprocess.run")
+    def test_resolve_uses_cache(self, mock_run, tmp_path):
+        """Test that a cached resolution skips dnf entirely."""
+        mock_run.side_effect = [
+            MagicMock(returncode=0, stdout="bash\n", stderr=""),
+            MagicMock(returncode=1, stdout="", stderr=""),
+            MagicMock(returncode=0, stdout="", stderr=""),
+            MagicMock(
+                returncode=0,
+                stdout="bash|0|5.1.8|9.el9|x86_64|baseos|1800000\n",
+                stderr="",
+            ),
+        ]
+
+        first = DependencyResolver(["bash"], prefer_security=False, cache_dir=tmp_path)
+        resolved = first.resolve()
+        calls = mock_run.call_count
+
+        second = DependencyResolver(["bash"], prefer_security=False, cache_dir=tmp_path)
+        cached = second.resolve()
+
+        assert mock_run.call_count == calls
+        assert cached == resolved
+
+
+    def test_save_cached_resolution_failure_is_not_an_error(self, tmp_path, capsys):
+        """Test that an unwritable cache warns without failing the resolution."""
+        cache_dir = tmp_path / "cache"
+        cache_dir.write_text("not a directory")
+        resolver = DependencyResolver(["bash"], cache_dir=cache_dir)
+
+        resolver._save_cached_resolution(cache_dir / "key.json")
+
+        assert resolver.errors == []
+        assert "could not write resolution cache" in capsys.readouterr().err
+
+    def test_save_cached_resolution_is_atomic(self, tmp_path):
+        """Test that the resolution cache is replaced, never written in place."""
+        resolver = DependencyResolver(["bash"], cache_dir=tmp_path)
+        resolver.resolved = [ResolvedPackage(
+            name="bash", epoch="0", version="5.1.8", release="9.el9",
+            arch="x86_64", nevra="bash-5.1.8-9.el9.x86_64", repo_id="baseos",
+            package_type="update",
+        )]
+        cache_path = tmp_path / "key.json"
 
+        with patch("src.bundle_builder.resolver.os.replace", side_effect=OSError("EIO")):
+            resolver._save_cached_resolution(cache_path)
+        assert list(tmp_path.iterdir()) == []
+
+        resolver._save_cached_resolution(cache_path)
+        assert [p.name for p in tmp_path.iterdir()] == ["key.json"]
+        assert resolver._load_cached_resolution(cache_path) == resolver.resolved
 
 class TestRPMDownloader:
     """Tests for RPMDownloader."""
@@ -188,3 +356,320 @@ class TestRPMDownloader:
         content = checksums_path.read_text()
         assert sha256 in content
         assert "test-1.0-1.x86_64.rpm" in content
+
+    def test_verify_downloads(self, tmp_path):
+        """Test matching downloaded RPMs to packages and hashing them."""
+        rpm_file = tmp_path / "test-1.0-1.x86_64.rpm"
+        rpm_file.write_text("fake rpm content")
+
+        downloader = RPMDownloader(tmp_path)
+
+        found = ResolvedPackage(
+            name="test",
+            epoch="0",
+            version="1.0",
+            release="1",
+            arch="x86_64",
+            nevra="test-1.0-1.x86_64",
+            repo_id="test",
+            package_type="update"
+        )
+        missing = ResolvedPackage(
+            name="missing",
+            epoch="0",
+            version="1.0",
+            release="1",
+            arch="x86_64",
+            nevra="missing-1.0-1.x86_64",
+            repo_id="test",
+            package_type="dependency"
+        )
+
+        downloader._verify_downloads([found, missing])
+
+        assert len(downloader.results) == 2
+        assert downloader.results[0].success is True
+        assert downloader.results[0].local_path == rpm_file
+        assert downloader.results[0].sha256 == downloader._compute_sha256(rpm_file)
+        assert downloader.results[0].size == rpm_file.stat().st_size
+        assert downloader.results[1].success is False
+
+    def test_verify_downloads_matches_name_and_arch(self, tmp_path):
+        """Test RPMs are matched by exact name, preferring the package arch."""
+        for filename in (
+            "glibc-2.34-1.el9.i686.rpm",
+            "glibc-2.34-1.el9.x86_64.rpm",
+            "python3-libs-3.9.18-1.el9.x86_64.rpm",
+        ):
+            (tmp_path / filename).write_text(filename)
+
+        glibc = ResolvedPackage(
+            name="glibc",
+            epoch="0",
+            version="2.34",
+            release="1.el9",
+            arch="x86_64",
+            nevra="glibc-2.34-1.el9.x86_64",
+            repo_id="test",
+            package_type="update"
+        )
+        python3 = ResolvedPackage(
+            name="python3",
+            epoch="0",
+            version="3.9.18",
+            release="1.el9",
+            arch="x86_64",
+            nevra="python3-3.9.18-1.el9.x86_64",
+            repo_id="test",
+            package_type="dependency"
+        )
+
+        downloader = RPMDownloader(tmp_path, cache_checksums=False)
+        downloader._verify_downloads([glibc, python3])
+
+        assert downloader.results[0].local_path.name == "glibc-2.34-1.el9.x86_64.rpm"
+        assert downloader.results[1].success is False
+
+    def test_verify_downloads_uses_checksum_cache(self, tmp_path):
+        """Test unchanged RPMs reuse checksums cached by a previous run."""
+        rpm_file = tmp_path / "test-1.0-1.x86_64.rpm"
+        rpm_file.write_text("fake rpm content")
+
+        pkg = ResolvedPackage(
+            name="test",
+            epoch="0",
+            version="1.0",
+            release="1",
+            arch="x86_64",
+            nevra="test-1.0-1.x86_64",
+            repo_id="test",
+            package_type="update"
+        )
+
+        RPMDownloader(tmp_path)._verify_downloads([pkg])
+
+        cache_file = tmp_path / RPMDownloader.CHECKSUM_CACHE_NAME
+        cache = json.loads(cache_file.read_text())
+        cache[rpm_file.name][2] = "cached"
+        cache_file.write_text(json.dumps(cache))
+
+        downloader = RPMDownloader(tmp_path)
+        downloader._verify_downloads([pkg])
+
+        assert downloader.results[0].sha256 == "cached"
+
+    @pytest.mark.parametrize("make_cache", [
+        lambda name, stat: [],
+        lambda name, stat: {name: [stat.st_size, stat.st_mtime_ns]},
+        lambda name, stat: {name: "not a list"},
+    ])
+    def test_verify_downloads_malformed_checksum_cache(self, tmp_path, make_cache):
+        """Test that a wrongly shaped checksum cache is treated as a miss."""
+        rpm_file = tmp_path / "test-1.0-1.x86_64.rpm"
+        rpm_file.write_text("fake rpm content")
+        cache = make_cache(rpm_file.name, rpm_file.stat())
+        (tmp_path / RPMDownloader.CHECKSUM_CACHE_NAME).write_text(json.dumps(cache))
+
+        pkg = ResolvedPackage(
+            name="test",
+            epoch="0",
+            version="1.0",
+            release="1",
+            arch="x86_64",
+            nevra="test-1.0-1.x86_64",
+            repo_id="test",
+            package_type="update"
+        )
+
+        downloader = RPMDownloader(tmp_path)
+        downloader._verify_downloads([pkg])
+
+        assert downloader.results[0].sha256 == sha256_file(rpm_file)
+
+    def test_verify_downloads_keeps_other_cache_entries(self, tmp_path):
+        """Test that saving the checksum cache keeps entries for other RPMs."""
+        rpm_file = tmp_path / "test-1.0-1.x86_64.rpm"
+        rpm_file.write_text("fake rpm content")
+        cache_file = tmp_path / RPMDownloader.CHECKSUM_CACHE_NAME
+        other = {"other-2.0-1.x86_64.rpm": [10, 1700000000000000000, "abc123"]}
+        cache_file.write_text(json.dumps(other))
+
+        pkg = ResolvedPackage(
+            name="test",
+            epoch="0",
+            version="1.0",
+            release="1",
+            arch="x86_64",
+            nevra="test-1.0-1.x86_64",
+            repo_id="test",
+            package_type="update"
+        )
+
+        RPMDownloader(tmp_path)._verify_downloads([pkg])
+
+        cache = json.loads(cache_file.read_text())
+        assert cache["other-2.0-1.x86_64.rpm"] == other["other-2.0-1.x86_64.rpm"]
+        assert cache[rpm_file.name][2] == sha256_file(rpm_file)
+
+    @patch("shutil.which", return_value="/usr/bin/aria2c")
+    @patch("subprocess.run")
+    def test_aria2c_falls_back_to_dnf(self, mock_run, mock_which, tmp_path):
+        """Test that a failed aria2c download falls back to dnf download."""
+        mock_run.return_value = MagicMock(returncode=1, stdout="", stderr="")
+
+        pkg = ResolvedPackage(
+            name="test",
+            epoch="0",
+            version="1.0",
+            release="1",
+            arch="x86_64",
+            nevra="test-1.0-1.x86_64",
+            repo_id="test",
+            package_type="update"
+        )
+
+        downloader = RPMDownloader(tmp_path, use_aria2c=True)
+        downloader.download_packages([pkg])
+
+        commands = [call.args[0][:2] for call in mock_run.call_args_list]
+        assert commands == [["dnf", "repoquery"], ["dnf", "download"]]
+
+
+class TestBundleBuilder:
+    """Tests for BundleBuilder."""
+
+    def test_default_compression_level(self, tmp_path):
+        """Test builder uses a moderate zstd level by default."""
+        builder = BundleBuilder(9, tmp_path, tmp_path / "out", tmp_path / "work")
+
+        assert builder.compression_level == 9
+
+    def test_invalid_compression_level(self, tmp_path):
+        """Test that out-of-range compression level raises error."""
+        with pytest.raises(ValueError):
+            BundleBuilder(9, tmp_path, tmp_path / "out", compression_level=22)
+
+    def test_create_archive_hash(self, tmp_path):
+        """Test archive hash is computed while the archive is written."""
+        builder = BundleBuilder(9, tmp_path, tmp_path / "out", tmp_path / "work")
+        builder.bundle_id = "bundle-rhel9-20240115T120000Z"
+
+        source_dir = tmp_path / "work" / builder.bundle_id
+        (source_dir / "rpms").mkdir(parents=True)
+        (source_dir / "rpms" / "test-1.0-1.x86_64.rpm").write_text("fake rpm content")
+
+        archive_path, bundle_hash = builder._create_archive(source_dir)
+
+        assert archive_path.exists()
+        assert bundle_hash == sha256_file(archive_path)
+
+    @patch("src.bundle_builder.builder.HashingWriter.write")
+    def test_create_archive_write_error_raises(self, mock_write, tmp_path):
+        """Test that a failed archive write raises instead of hanging or falling back."""
+        mock_write.side_effect = OSError(errno.ENOSPC, "No space left on device")
+        builder = BundleBuilder(9, tmp_path, tmp_path / "out", tmp_path / "work")
+        builder.bundle_id = "bundle-rhel9-20240115T120000Z"
+
+        # Incompressible and larger than the pipe buffers, so zstd would block
+        source_dir = tmp_path / "work" / builder.bundle_id
+        (source_dir / "rpms").mkdir(parents=True)
+        (source_dir / "rpms" / "test-1.0-1.x86_64.rpm").write_bytes(os.urandom(4 << 20))
+
+        with pytest.raises(OSError) as excinfo:
+            builder._create_archive(source_dir)
+
+        assert excinfo.value.errno == errno.ENOSPC
+        assert list((tmp_path / "out").iterdir()) == []
+
+    @patch("src.bundle_builder.builder.subprocess.Popen", side_effect=FileNotFoundError)
+    @patch("src.bundle_builder.builder.HashingWriter.write")
+    def test_create_archive_gzip_write_error_raises(self, mock_write, mock_popen, tmp_path):
+        """Test that a failed gzip fallback write raises and removes the partial archive."""
+        mock_write.side_effect = OSError(errno.ENOSPC, "No space left on device")
+        builder = BundleBuilder(9, tmp_path, tmp_path / "out", tmp_path / "work")
+        builder.bundle_id = "bundle-rhel9-20240115T120000Z"
+
+        source_dir = tmp_path / "work" / builder.bundle_id
+        (source_dir / "rpms").mkdir(parents=True)
+        (source_dir / "rpms" / "test-1.0-1.x86_64.rpm").write_bytes(os.urandom(1 << 20))
+
+        with pytest.raises(OSError) as excinfo:
+            builder._create_archive(source_dir)
+
+        assert excinfo.value.errno == errno.ENOSPC
+        assert list((tmp_path / "out").iterdir()) == []
+
+    @patch.object(BundleBuilder, "_generate_repodata")
+    @patch.object(DependencyResolver, "resolve", return_value=[])
+    def test_build(self, mock_resolve, mock_repodata, tmp_path, manifest_dir):
+        """Test a full build with no updates produces a verified archive."""
+        builder = BundleBuilder(9, manifest_dir, tmp_path / "out", tmp_path / "work")
+
+        archive_path = builder.build()
+
+        checksum_file = tmp_path / "out" / f"{builder.bundle_id}.sha256"
+        assert checksum_file.read_text() == f"{sha256_file(archive_path)}  {archive_path.name}\n"
+        assert builder.metadata["manifests_used"][0]["host_id"] == "test-host-01"
+        assert list((tmp_path / "work").iterdir()) == []
+        assert not any(
+            builder._is_own_record in handler.filters
+            for handler in logging.getLogger("src.bundle_builder.builder").handlers
+        )
+
+        if archive_path.suffix == ".zst":
+            tar_bytes = subprocess.run(
+                ["zstd", "-dc", str(archive_path)], capture_output=True, check=True
+            ).stdout
+            tar = tarfile.open(fileobj=io.BytesIO(tar_bytes))
+        else:
+            tar = tarfile.open(archive_path)
+        with tar:
+            build_log = tar.extractfile(f"{builder.bundle_id}/build.log").read().decode()
+            names = tar.getnames()
+
+        assert f"Starting bundle build: {builder.bundle_id}" in build_log
+        assert "Step 8: Finalizing" in build_log
+        assert f"{builder.bundle_id}/metadata.json" in names
+        assert f"{builder.bundle_id}/manifests/test-host-01-manifest.json" in names
+
+    def test_build_logging_leaves_logger_config(self, tmp_path, caplog):
+        """Test that build logging propagates and keeps the logger's level."""
+        logger = logging.getLogger("src.bundle_builder.builder")
+        builder = BundleBuilder(9, tmp_path, tmp_path / "out", tmp_path / "work")
+        builder._start_logging(tmp_path / "build.log")
+        try:
+            with caplog.at_level(logging.INFO, logger=logger.name):
+                builder._log("visible to the application")
+            logger.setLevel(logging.WARNING)
+            builder._log("only in the build log")
+        finally:
+            builder._stop_logging()
+            logger.setLevel(logging.NOTSET)
+
+        assert logger.propagate
+        assert caplog.messages == ["visible to the application"]
+        assert "only in the build log" in (tmp_path / "build.log").read_text()
+
+    def test_build_logs_are_isolated(self, tmp_path):
+        """Test that builds sharing a bundle ID do not write to each other's log."""
+        first = BundleBuilder(9, tmp_path, tmp_path / "out", tmp_path / "work")
+        second = BundleBuilder(9, tmp_path, tmp_path / "out", tmp_path / "work")
+        first.bundle_id = second.bundle_id = "bundle-rhel9-20240115T120000Z"
+
+        first._start_logging(tmp_path / "first.log")
+        second._start_logging(tmp_path / "second.log")
+        try:
+            first._log("from first")
+            second._log("from second")
+        finally:
+            first._stop_logging()
+            second._stop_logging()
+
+        first_log = (tmp_path / "first.log").read_text()
+        assert re.fullmatch(r"\[\d{4}-\d\d-\d\dT[\d:]{8}\.\d{3}Z\] from first\n", first_log)
+        assert "from first" not in (tmp_path / "second.log").read_text()
+        for builder in (first, second):
+            assert not any(
+                builder._is_own_record in handler.filters
+                for handler in logging.getLogger("src.bundle_builder.builder").handlers
+            )
@@ -1,102 +1,118 @@
 """Tests for manifest tools."""
 
+import hashlib
 import json
 import pytest
-from pathlib import Path
-
-import sys
-sys.path.insert(0, str(Path(__file__).parent.parent))
+from types import SimpleNamespace
+from unittest.mock import patch, MagicMock
 
 from src.manifest_tools.validator import ManifestValidator
-from src.manifest_tools.merger import ManifestMerger
+from src.manifest_tools.merger import ManifestMerger, main as merger_main
+from src.manifest_tools.collector import ManifestCollector
+
+
+@pytest.fixture(scope="module")
+def validator():
+    """Return a validator shared by the tests in this module."""
+    return ManifestValidator()
 
 
 class TestManifestValidator:
     """Tests for ManifestValidator."""
 
-    def test_valid_manifest(self, sample_manifest):
+    def test_valid_manifest(self, validator, sample_manifest):
         """Test validation of a valid manifest."""
-        validator = ManifestValidator()
         assert validator.validate(sample_manifest) is True
         assert len(validator.errors) == 0
 
-    def test_missing_required_field(self, sample_manifest):
+    def test_missing_required_field(self, validator, sample_manifest):
         """Test validation fails when required field is missing."""
-        validator = ManifestValidator()
-        
         # Remove required field
         del sample_manifest["host_id"]
         
         assert validator.validate(sample_manifest) is False
-        assert any("host_id" in e for e in validator.errors)
+        assert "host_id" in validator.errors_text
 
-    def test_invalid_os_major(self, sample_manifest):
+    def test_invalid_os_major(self, validator, sample_manifest):
         """Test validation fails for invalid OS major version."""
-        validator = ManifestValidator()
-        
         sample_manifest["os"]["major"] = 7
         
         assert validator.validate(sample_manifest) is False
-        assert any("OS major version" in e for e in validator.errors)
+        assert "OS major version" in validator.errors_text
 
-    def test_invalid_arch(self, sample_manifest):
+    def test_invalid_arch(self, validator, sample_manifest):
         """Test validation fails for invalid architecture."""
-        validator = ManifestValidator()
-        
         sample_manifest["arch"] = "ppc64le"
         
         assert validator.validate(sample_manifest) is False
-        assert any("architecture" in e for e in validator.errors)
+        assert "architecture" in validator.errors_text
+
+    def test_invalid_timestamp(self, validator, sample_manifest):
+        """Test validation fails for a timestamp without time or offset."""
+        sample_manifest["timestamp"] = "2024-01-15 T"
+
+        assert validator.validate(sample_manifest) is False
+        assert "timestamp" in validator.errors_text
+
+        sample_manifest["timestamp"] = "2024-01-15T12:00:00.123456+00:00"
+        assert validator.validate(sample_manifest) is True
 
-    def test_empty_rpms_warning(self, sample_manifest):
+        sample_manifest["timestamp"] = 1705320000
+        assert validator.validate(sample_manifest) is False
+        assert "timestamp must be a string" in validator.errors
+
+    def test_empty_rpms_warning(self, validator, sample_manifest):
         """Test validation warns on empty RPM list."""
-        validator = ManifestValidator()
-        
         sample_manifest["installed_rpms"] = []
         
         # Should still validate but with warning
         validator.validate(sample_manifest)
         assert any("empty" in w for w in validator.warnings)
 
-    def test_validate_file(self, tmp_path, sample_manifest):
+    def test_validate_file(self, validator, tmp_path, sample_manifest):
         """Test file validation."""
-        validator = ManifestValidator()
-        
         manifest_file = tmp_path / "test.json"
-        with open(manifest_file, "w") as f:
-            json.dump(sample_manifest, f)
+        manifest_file.write_text(json.dumps(sample_manifest))
         
         assert validator.validate_file(manifest_file) is True
 
-    def test_validate_invalid_json(self, tmp_path):
+    def test_validate_invalid_json(self, validator, tmp_path):
         """Test validation fails for invalid JSON."""
-        validator = ManifestValidator()
-        
         bad_file = tmp_path / "bad.json"
-        with open(bad_file, "w") as f:
-            f.write("not valid json")
+        bad_file.write_text("not valid json")
         
         assert validator.validate_file(bad_file) is False
         assert any("Invalid JSON" in e for e in validator.errors)
 
-    def test_validate_missing_file(self, tmp_path):
+    def test_validate_bytes_invalid_json(self, validator):
+        """Test validation of in-memory content fails for invalid JSON."""
+        assert validator.validate_bytes(b"not valid json") is False
+        assert any("Invalid JSON" in e for e in validator.errors)
+
+    def test_validate_missing_file(self, validator, tmp_path):
         """Test validation fails for missing file."""
-        validator = ManifestValidator()
-        
         assert validator.validate_file(tmp_path / "nonexistent.json") is False
         assert any("not found" in e for e in validator.errors)
 
+    def test_validator_reuse_clears_warnings(self, validator, tmp_path, sample_manifest):
+        """Test that a reused validator does not report stale warnings."""
+        sample_manifest["installed_rpms"] = []
+        validator.validate(sample_manifest)
+        assert validator.warnings
+
+        assert validator.validate_file(tmp_path / "nonexistent.json") is False
+        assert validator.warnings == []
+
 
 class TestManifestMerger:
     """Tests for ManifestMerger."""
 
     def test_merge_single_manifest(self, tmp_path, sample_manifest):
-        """Test merging a single manifest."""
+        """Test merging a single manifest file."""
         merger = ManifestMerger(os_major=9)
         
         manifest_file = tmp_path / "test.json"
-        with open(manifest_file, "w") as f:
-            json.dump(sample_manifest, f)
+        manifest_file.write_text(json.dumps(sample_manifest))
         
         result = merger.add_manifest(manifest_file)
         assert result is True
@@ -107,13 +123,20 @@ class TestManifestMerger:
         merger = ManifestMerger(os_major=9)
         
         manifest_file = tmp_path / "rhel8.json"
-        with open(manifest_file, "w") as f:
-            json.dump(sample_manifest_rhel8, f)
+        manifest_file.write_text(json.dumps(sample_manifest_rhel8))
         
         result = merger.add_manifest(manifest_file)
         assert result is False
         assert len(merger.manifests) == 0
 
+    def test_merge_bytes_wrong_os_version(self, sample_manifest_rhel8):
+        """Test that wrong OS version manifests are rejected from memory."""
+        merger = ManifestMerger(os_major=9)
+        
+        result = merger.add_manifest_bytes(json.dumps(sample_manifest_rhel8).encode())
+        assert result is False
+        assert len(merger.manifests) == 0
+
     def test_merge_from_directory(self, manifest_dir):
         """Test merging from directory."""
         merger = ManifestMerger(os_major=9)
@@ -123,36 +146,149 @@ class TestManifestMerger:
         assert count == 1
         assert len(merger.manifests) == 1
 
-    def test_get_merged_installed_rpms(self, tmp_path, sample_manifest):
+    def test_merge_from_directory_skips_invalid_json(
+        self, writable_manifest_dir, sample_manifest
+    ):
+        """Test that non-manifest JSON files are tried and bad ones skipped."""
+        manifest_dir = writable_manifest_dir
+        (manifest_dir / "notes.json").write_text("not json")
+        sample_manifest["host_id"] = "test-host-02"
+        (manifest_dir / "host02.json").write_text(json.dumps(sample_manifest))
+
+        merger = ManifestMerger(os_major=9)
+        count = merger.add_manifests_from_directory(manifest_dir)
+
+        assert count == 2
+        assert sorted(m["host_id"] for m in merger.manifests) == [
+            "test-host-01",
+            "test-host-02",
+        ]
+
+    def test_get_merged_installed_rpms(self, sample_manifest):
         """Test getting merged RPM list."""
         merger = ManifestMerger(os_major=9)
         
-        manifest_file = tmp_path / "test.json"
-        with open(manifest_file, "w") as f:
-            json.dump(sample_manifest, f)
-        
-        merger.add_manifest(manifest_file)
+        merger.add_manifest_dict(sample_manifest)
         merged = merger.get_merged_installed_rpms()
         
         assert "bash" in merged
         assert "kernel" in merged
         assert "openssl" in merged
 
-    def test_get_host_summary(self, tmp_path, sample_manifest):
+    def test_get_host_summary(self, sample_manifest):
         """Test getting host summary."""
         merger = ManifestMerger(os_major=9)
         
-        manifest_file = tmp_path / "test.json"
-        with open(manifest_file, "w") as f:
-            json.dump(sample_manifest, f)
-        
-        merger.add_manifest(manifest_file)
+        merger.add_manifest_dict(sample_manifest)
         summary = merger.get_host_summary()
         
         assert len(summary) == 1
         assert summary[0]["host_id"] == "test-host-01"
         assert summary[0]["os_minor"] == 6
 
+    def test_manifest_hash_matches_file(self, tmp_path, sample_manifest):
+        """Test that the manifest hash is the SHA256 of the file on disk."""
+        merger = ManifestMerger(os_major=9)
+
+        manifest_file = tmp_path / "test.json"
+        manifest_file.write_text(json.dumps(sample_manifest, indent=2))
+
+        merger.add_manifest(manifest_file)
+
+        expected = hashlib.sha256(manifest_file.read_bytes()).hexdigest()
+        assert merger.manifest_hashes["test-host-01"] == f"sha256:{expected}"
+
+    def test_duplicate_manifest_skipped(self, writable_manifest_dir):
+        """Test that a byte-identical copy of a manifest is only added once."""
+        manifest_dir = writable_manifest_dir
+        original = manifest_dir / "test-host-01-manifest.json"
+        (manifest_dir / "copy.json").write_bytes(original.read_bytes())
+
+        merger = ManifestMerger(os_major=9)
+        count = merger.add_manifests_from_directory(manifest_dir)
+
+        assert count == 1
+        assert merger.get_package_to_hosts_map()["bash"] == ["test-host-01"]
+
+    def test_cli_reports_duplicate_manifest(self, writable_manifest_dir, capsys):
+        """Test that the CLI reports duplicates separately from OS mismatches."""
+        original = writable_manifest_dir / "test-host-01-manifest.json"
+        copy = writable_manifest_dir / "copy.json"
+        copy.write_bytes(original.read_bytes())
+        rhel8 = writable_manifest_dir / "test-host-rhel8-manifest.json"
+
+        argv = ["rpm-manifest-merge", "--os-major", "9", "-o", "/dev/null"]
+        with patch("sys.argv", argv + [str(original), str(copy), str(rhel8)]):
+            merger_main()
+
+        out = capsys.readouterr().out
+        assert f"Skipped (duplicate): {copy}" in out
+        assert f"Skipped (wrong OS version): {rhel8}" in out
+
+    def test_parsed_manifest_cache(self, tmp_path, sample_manifest):
+        """Test that parsed manifests are reused from the cache directory."""
+        cache_dir = tmp_path / "cache"
+        manifest_file = tmp_path / "test.json"
+        manifest_file.write_text(json.dumps(sample_manifest))
+
+        first = ManifestMerger(os_major=9, cache_dir=cache_dir)
+        assert first.add_manifest(manifest_file) is True
+        assert len(list(cache_dir.iterdir())) == 1
+
+        second = ManifestMerger(os_major=9, cache_dir=cache_dir)
+        with patch(
+            "src.manifest_tools.merger.loads_json",
+            side_effect=AssertionError("parsed again"),
+        ):
+            assert second.add_manifest(manifest_file) is True
+
+        assert second.manifests == first.manifests
+        assert second.manifest_hashes == first.manifest_hashes
+
+    @pytest.mark.parametrize("entry", [b"", b"\xff garbage", b"\xe9\x01\x00\x00\x00"])
+    def test_parsed_manifest_cache_bad_entry(self, tmp_path, sample_manifest, entry):
+        """Test that truncated, corrupt or non-dict cache entries are replaced."""
+        cache_dir = tmp_path / "cache"
+        manifest_file = tmp_path / "test.json"
+        manifest_file.write_text(json.dumps(sample_manifest))
+
+        ManifestMerger(os_major=9, cache_dir=cache_dir).add_manifest(manifest_file)
+        (cache_path,) = cache_dir.iterdir()
+        cache_path.write_bytes(entry)
+
+        merger = ManifestMerger(os_major=9, cache_dir=cache_dir)
+        assert merger.add_manifest(manifest_file) is True
+        assert merger.manifests == [sample_manifest]
+        assert cache_path.read_bytes() != entry
+
+    def test_aggregates_refresh_after_add(self, sample_manifest):
+        """Test that cached aggregates are rebuilt when a manifest is added."""
+        merger = ManifestMerger(os_major=9)
+
+        merger.add_manifest_dict(sample_manifest)
+        assert merger.get_package_to_hosts_map()["bash"] == ["test-host-01"]
+
+        sample_manifest["host_id"] = "test-host-02"
+        merger.add_manifest_dict(sample_manifest)
+
+        assert merger.get_package_to_hosts_map()["bash"] == ["test-host-01", "test-host-02"]
+        assert len(merger.get_host_summary()) == 2
+
+    def test_getters_return_copies(self, sample_manifest):
+        """Test that modifying a getter result does not affect later calls."""
+        merger = ManifestMerger(os_major=9)
+        merger.add_manifest_dict(sample_manifest)
+
+        merger.get_merged_installed_rpms()["bash"].add("bogus")
+        merger.get_package_to_hosts_map()["bash"].append("bogus")
+        merger.get_enabled_repos_union().clear()
+        merger.get_host_summary()[0]["host_id"] = "bogus"
+
+        assert merger.get_merged_installed_rpms()["bash"] == {"bash-5.1.8-6.el9.x86_64"}
+        assert merger.get_package_to_hosts_map()["bash"] == ["test-host-01"]
+        assert len(merger.get_enabled_repos_union()) == 2
+        assert merger.generate_merge_report()["hosts"][0]["host_id"] == "test-host-01"
+
     def test_generate_merge_report(self, manifest_dir):
         """Test generating merge report."""
         merger = ManifestMerger(os_major=9)
@@ -165,7 +301,178 @@ class TestManifestMerger:
         assert "unique_packages" in report
         assert "generated_at" in report
 
+    def test_add_manifest_bytes_default_host_id(self, sample_manifest):
+        """Test that in-memory manifests without a host_id use the source."""
+        del sample_manifest["host_id"]
+        merger = ManifestMerger(os_major=9)
+
+        assert merger.add_manifest_bytes(
+            json.dumps(sample_manifest).encode(), source="upload"
+        ) is True
+        assert merger.manifest_hashes.keys() == {"upload"}
+
+    def test_add_manifest_dict_skips_duplicate(self, sample_manifest, sample_manifest_data):
+        """Test that an equal parsed manifest is only added once."""
+        merger = ManifestMerger(os_major=9)
+
+        assert merger.add_manifest_dict(sample_manifest) is True
+        assert merger.add_manifest_dict(dict(reversed(sample_manifest_data.items()))) is False
+        assert merger.manifest_hashes["test-host-01"].startswith("sha256:")
+
+    def test_add_manifest_dict_hash_without_orjson(self, sample_manifest):
+        """Test that the canonical hash does not depend on orjson."""
+        from src.manifest_tools import jsonio
+
+        sample_manifest["kernel_version"] = "5.14.0-427.el9.x86_64 (résumé)"
+
+        with_default = ManifestMerger(os_major=9)
+        with_default.add_manifest_dict(sample_manifest)
+
+        with patch.object(jsonio, "orjson", None):
+            stdlib = ManifestMerger(os_major=9)
+            stdlib.add_manifest_dict(sample_manifest)
+
+        assert stdlib.manifest_hashes == with_default.manifest_hashes
+
     def test_invalid_os_major(self):
         """Test that invalid OS major raises error."""
         with pytest.raises(ValueError):
             ManifestMerger(os_major=7)
+
+
+class TestManifestCollector:
+    """Tests for ManifestCollector."""
+
+    @patch("src.manifest_tools.collector.rpm", None)
+    @patch("subprocess.Popen")
+    def test_get_installed_rpms_without_bindings(self, mock_popen, tmp_path):
+        """Test RPM collection through the rpm command."""
+        proc = mock_popen.return_value.__enter__.return_value
+        proc.stdout = iter([
+            "openssl\t1\t3.0.7\t25.el9\tx86_64\n",
+            "bash\t(none)\t5.1.8\t6.el9\tx86_64\n",
+        ])
+        proc.returncode = 0
+
+        collector = ManifestCollector(output_dir=str(tmp_path))
+        rpms = collector._get_installed_rpms()
+
+        assert [r["nevra"] for r in rpms] == [
+            "bash-5.1.8-6.el9.x86_64",
+            "openssl-1:3.0.7-25.el9.x86_64",
+        ]
+        assert rpms[0]["epoch"] == "0"
+
+    @staticmethod
+    def _fake_rpm_module(headers=None, fail=False):
+        """Build a stand-in for the python3-rpm bindings."""
+        class RpmError(Exception):
+            pass
+
+        def transaction_set():
+            if fail:
+                raise RpmError("cannot open Packages database")
+            return MagicMock(dbMatch=MagicMock(return_value=headers))
+
+        return SimpleNamespace(
+            RPMTAG_NAME="name",
+            RPMTAG_EPOCH="epoch",
+            RPMTAG_VERSION="version",
+            RPMTAG_RELEASE="release",
+            RPMTAG_ARCH="arch",
+            TransactionSet=transaction_set,
+            error=RpmError,
+        )
+
+    @patch("subprocess.Popen")
+    def test_get_installed_rpms_with_bindings(self, mock_popen, tmp_path):
+        """Test that the RPM database path matches the rpm command output."""
+        proc = mock_popen.return_value.__enter__.return_value
+        proc.stdout = iter([
+            "openssl\t1\t3.0.7\t25.el9\tx86_64\n",
+            "bash\t(none)\t5.1.8\t6.el9\tx86_64\n",
+        ])
+        proc.returncode = 0
+        collector = ManifestCollector(output_dir=str(tmp_path))
+
+        with patch("src.manifest_tools.collector.rpm", None):
+            expected = collector._get_installed_rpms()
+
+        headers = [
+            {"name": "openssl", "epoch": 1, "version": "3.0.7",
+             "release": "25.el9", "arch": "x86_64"},
+            {"name": b"bash", "epoch": None, "version": b"5.1.8",
+             "release": b"6.el9", "arch": b"x86_64"},
+        ]
+        mock_popen.reset_mock()
+        with patch("src.manifest_tools.collector.rpm", self._fake_rpm_module(headers)):
+            rpms = collector._get_installed_rpms()
+
+        assert rpms == expected
+        mock_popen.assert_not_called()
+
+    @patch("subprocess.Popen")
+    def test_get_installed_rpms_bindings_error_falls_back(self, mock_popen, tmp_path):
+        """Test that an RPM database error falls back to the rpm command."""
+        proc = mock_popen.return_value.__enter__.return_value
+        proc.stdout = iter(["bash\t(none)\t5.1.8\t6.el9\tx86_64\n"])
+        proc.returncode = 0
+
+        collector = ManifestCollector(output_dir=str(tmp_path))
+        with patch("src.manifest_tools.collector.rpm", self._fake_rpm_module(fail=True)):
+            rpms = collector._get_installed_rpms()
+
+        assert [r["nevra"] for r in rpms] == ["bash-5.1.8-6.el9.x86_64"]
+        mock_popen.assert_called_once()
+
+    @pytest.mark.parametrize("hostname,fqdn,expected", [
+        ("db01.example.com", "localhost", "db01.example.com"),
+        ("db01", "db01.example.com", "db01.example.com"),
+        ("db01", "localhost", "db01"),
+        ("db01", "localhost.localdomain", "db01"),
+    ])
+    def test_get_host_id(self, tmp_path, hostname, fqdn, expected):
+        """Test that host IDs match `hostname -f`, even with a loopback hosts entry."""
+        collector = ManifestCollector(output_dir=str(tmp_path))
+        with patch("socket.gethostname", return_value=hostname), \
+                patch("socket.getfqdn", return_value=fqdn):
+            assert collector._get_host_id() == expected
+
+    @pytest.mark.parametrize("use_orjson", [True, False])
+    def test_collect_and_save_output(self, tmp_path, sample_manifest, use_orjson):
+        """Test that saved manifests are the same with or without orjson."""
+        from src.manifest_tools import jsonio
+
+        encoder = jsonio.orjson if use_orjson else None
+        if use_orjson and encoder is None:
+            pytest.skip("orjson not installed")
+
+        sample_manifest["enabled_repos"][0]["name"] = "Dépôt BaseOS – 日本"
+
+        collector = ManifestCollector(output_dir=str(tmp_path))
+        with patch.object(jsonio, "orjson", encoder), \
+                patch.object(collector, "collect", return_value=sample_manifest):
+            path = collector.collect_and_save()
+
+        assert path.name == "test-host-01-manifest.json"
+        assert path.read_bytes() == json.dumps(
+            sample_manifest, indent=2, sort_keys=True, ensure_ascii=False
+        ).encode()
+
+    @patch("subprocess.run")
+    def test_get_applicable_advisories(self, mock_run, tmp_path):
+        """Test advisory collection and reporting of a failed dnf query."""
+        mock_run.return_value = MagicMock(
+            returncode=0,
+            stdout="RHSA-2024:1234 Important/Sec. bash-5.1.8-9.el9.x86_64\n",
+            stderr="",
+        )
+
+        collector = ManifestCollector(output_dir=str(tmp_path))
+        assert collector._get_applicable_advisories() == ["RHSA-2024:1234"]
+        assert mock_run.call_args.kwargs["timeout"] == 60
+        assert collector.errors == []
+
+        mock_run.return_value = MagicMock(returncode=1, stdout="", stderr="no metadata")
+        assert collector._get_applicable_advisories() == []
+        assert collector.errors == ["dnf updateinfo failed: no metadata"]